@@ -1,137 +1,196 @@
-import uuid
+import os
+import gc
+import atexit
+import csv
+import gzip
+import json
+import math
+import hashlib
+import inspect
+import heapq
 import time
 import random
 from datetime import datetime
-from threading import Lock
-from flask import Flask, render_template_string, request, jsonify
-from flask_socketio import SocketIO, emit, join_room
+from functools import wraps
+from flask import Flask, Response, render_template_string, request, jsonify
+from flask_socketio import SocketIO, emit, join_room, leave_room
+from gevent.event import Event
+from game_codes import ALPHABET, GameCodeAllocator
+from game_engine import STATUS_FIELDS, GameEngine, GameManager, Outbox
+from sampling_profiler import SamplingProfiler
+from memory_report import AllocationTracker, find_orphans, game_sizes, process_rss_kb, structure_sizes
+from traffic_recorder import TrafficRecorder, should_capture_body, should_record
+from quiz_library import QuizLibrary, QuizValidationError, normalize_question, normalize_questions
+from quiz_import import FORMATS, PARSERS, ImportFormatError, detect_format
+from results_archive import ResultsArchive
+from season_leaderboard import SeasonLeaderboard
+from media_store import EXTENSION_TYPES, MediaError, MediaFile, MediaStore, media_kind, media_range
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'секрет!'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='gevent')
+# Админские эндпоинты отключены, пока не задан токен
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+app.config['PROFILE_MAX_SECONDS'] = 60
+# Запись входящего трафика для benchmarks/replay.py, например QUIZ_RECORD=traffic-{pid}.jsonl.gz
+app.config['TRAFFIC_RECORD'] = os.environ.get('QUIZ_RECORD')
+app.config['DATABASE'] = os.environ.get('QUIZ_DATABASE', 'quiz.db')
+app.config['SEASON'] = os.environ.get('QUIZ_SEASON', 'default')
+# Запас времени между раскрытием вопроса и общим стартом
+app.config['REVEAL_LEAD'] = 0.3
+# Во сколько раз быстрее идут фазы игры, отсчёты и время на вопрос: replay.py --speed передаёт сюда своё ускорение
+app.config['GAME_SPEED'] = float(os.environ.get('QUIZ_GAME_SPEED', 1))
+app.config['GAME_START_DELAY'] = 2
+app.config['MEDIA_ROOT'] = os.environ.get('QUIZ_MEDIA_ROOT', 'media')
+app.config['MEDIA_MAX_SIZE'] = 10 * 1024 * 1024
+app.config['IMPORT_BATCH_SIZE'] = 500
+app.config['STATUS_LONG_POLL_MAX'] = 30
+# Коды игр: длина без префикса, префикс шарда для маршрутизации (QUIZ_CODE_SHARD=A — коды вида A7KM2QX)
+# и время без изменений, после которого игра выселяется при создании новой
+app.config['GAME_CODE_LENGTH'] = 6
+app.config['GAME_CODE_SHARD'] = os.environ.get('QUIZ_CODE_SHARD', '')
+# Номер воркера gunicorn (задаёт after_fork при нескольких воркерах)
+app.config['GAME_CODE_WORKER'] = None
+app.config['GAME_TTL'] = 6 * 3600
+app.config['SPECTATOR_TICK'] = 1.0
+# Консоль учителя: частота сводки и максимум игр на одно соединение
+app.config['CONSOLE_TICK'] = 1.0
+app.config['CONSOLE_MAX_GAMES'] = 20
+# Приём ответов: сколько раз можно сменить ответ и ограничение частоты на сокет
+app.config['MAX_ANSWER_CHANGES'] = 0
+app.config['ANSWER_BURST'] = 3
+app.config['ANSWER_RATE'] = 1.0
+app.config['ANSWER_GRACE'] = 0.5
+app.config['STATS_INTERVAL'] = 0.5
+app.config['ROSTER_INTERVAL'] = 0.25
+# Насколько сервер верит возрасту ответа из пачки классного ретранслятора (edge_relay.py)
+app.config['RELAY_MAX_DELAY'] = 0.25
+# Общий секрет ретрансляторов: без него любой сокет мог бы назваться ретранслятором и прибавлять
+# своим ответам возраст. Не задан — ретрансляторы не принимаются
+app.config['RELAY_TOKEN'] = os.environ.get('QUIZ_RELAY_TOKEN')
+app.config['SPECTATOR_TOP_K'] = 10
+app.config['IMPORT_MAX_ERRORS'] = 100
+# Кэш библиотеки: сколько викторин держать и сколько прогреть до форка воркеров
+app.config['QUIZ_CACHE_SIZE'] = 256
+app.config['QUIZ_CACHE_WARM'] = 64
+# Пороги нагрузки: (повышенная, высокая, критическая)
+app.config['LOAD_LAG_THRESHOLDS'] = (0.05, 0.2, 0.5)
+app.config['LOAD_QUEUE_THRESHOLDS'] = (500, 2000, 10000)
+app.config['LOAD_RETRY_AFTER'] = 10
+app.config['LOAD_JOIN_DELAY'] = 0.5
+socketio = SocketIO(cors_allowed_origins="*", async_mode='gevent')
+
+
+game_manager = GameManager(Event)
+# Хранилища создаёт create_app, когда конфигурация уже известна
+quiz_library = None
+results_archive = None
+season_leaderboard = None
+media_store = None
+index_page = None
+traffic_recorder = None
+
+
+class LoadMonitor:
+    NORMAL, ELEVATED, HIGH, CRITICAL = 0, 1, 2, 3
+    LEVEL_NAMES = ('normal', 'elevated', 'high', 'critical')
+
+    def __init__(self, interval=0.25, calm_ticks=8):
+        self.interval = interval
+        self.calm_ticks = calm_ticks
+        self.level = self.NORMAL
+        self.lag = 0.0
+        self.queue_depth = 0
+        self.started = False
+        self._calm = 0
+
+    def ensure_started(self):
+        if not self.started:
+            self.started = True
+            socketio.start_background_task(self.run)
+
+    def measure_queue_depth(self):
+        eio = getattr(socketio.server, 'eio', None)
+        if eio is None:
+            return 0
+        return sum(s.queue.qsize() for s in list(eio.sockets.values()))
+
+    @staticmethod
+    def level_for(value, thresholds):
+        level = LoadMonitor.NORMAL
+        for i, limit in enumerate(thresholds):
+            if value >= limit:
+                level = i + 1
+        return level
+
+    def run(self):
+        while True:
+            start = time.monotonic()
+            socketio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - start - self.interval)
+            # Быстро реагируем на рост задержки, медленно отпускаем
+            self.lag = lag if lag > self.lag else self.lag * 0.8 + lag * 0.2
+            self.queue_depth = self.measure_queue_depth()
+            level = max(self.level_for(self.lag, app.config['LOAD_LAG_THRESHOLDS']),
+                        self.level_for(self.queue_depth, app.config['LOAD_QUEUE_THRESHOLDS']))
+            if level >= self.level:
+                self.level = level
+                self._calm = 0
+            else:
+                self._calm += 1
+                if self._calm >= self.calm_ticks:
+                    self.level -= 1
+                    self._calm = 0
+
+    def status(self):
+        return {
+            'level': self.level,
+            'level_name': self.LEVEL_NAMES[self.level],
+            'lag_ms': round(self.lag * 1000, 1),
+            'queue_depth': self.queue_depth
+        }
+
 
+load_monitor = LoadMonitor()
 
-class GameManager:
+
+class GeventTransport:
+    # Транспорт ядра игры поверх Flask-SocketIO и gevent
     def __init__(self):
-        self.games = {}
-        self.questions = {}
-        self.player_scores = {}
-        self.question_timers = {}
-        self.auto_next_timers = {}
-        self.lock = Lock()
-
-    def create_game(self, game_code, title, questions):
-        shuffled_questions = []
-        for q in questions:
-            correct_text = q["options"][q["correct_answer"]]
-            options = q["options"].copy()
-            random.shuffle(options)
-            new_correct = options.index(correct_text)
-            shuffled_questions.append({
-                "text": q["text"],
-                "options": options,
-                "correct_answer": new_correct,
-                "time_limit": q["time_limit"]
-            })
-        with self.lock:
-            self.games[game_code] = {
-                "title": title,
-                "status": "waiting",
-                "players": [],
-                "current_question": 0,
-                "scores": {},
-                "created_at": datetime.now().isoformat(),
-                "host_connected": False,
-                "question_active": False,
-                "answers": {},
-                "question_start_time": None,
-                "question_end_time": None,
-                "server_start_time": None,
-                "server_time_limit": 0,
-                "results_shown": False,
-                "total_questions": len(shuffled_questions)
-            }
-            self.questions[game_code] = shuffled_questions
-            self.player_scores[game_code] = {}
-
-    def join_game(self, game_code, team_name):
-        with self.lock:
-            game = self.games.get(game_code)
-            if not game or game["status"] != "waiting":
-                return False
-            existing_player = next((p for p in game["players"] if p["name"] == team_name), None)
-            if existing_player:
-                if not existing_player["connected"]:
-                    existing_player["connected"] = True
-                    return True
-                else:
-                    return False
-            player = {
-                "id": str(uuid.uuid4()),
-                "name": team_name,
-                "score": 0,
-                "connected": True,
-                "last_answer": None,
-                "answer_time": None,
-                "joined_at": datetime.now().isoformat()
-            }
-            game["players"].append(player)
-            game["scores"][team_name] = 0
-            self.player_scores[game_code][team_name] = 0
-            return True
-
-    def disconnect_player(self, game_code, player_name):
-        with self.lock:
-            game = self.games.get(game_code)
-            if not game:
-                return
-            player = next((p for p in game["players"] if p["name"] == player_name), None)
-            if player:
-                player["connected"] = False
-
-    def get_game(self, game_code):
-        return self.games.get(game_code)
-
-    def start_game(self, game_code):
-        with self.lock:
-            game = self.games.get(game_code)
-            if not game or len(game["players"]) == 0:
-                return False
-            game["status"] = "active"
-            return True
-
-    def reset_game(self, game_code):
-        with self.lock:
-            game = self.games.get(game_code)
-            if not game or game['status'] != 'finished':
-                return
-            if game_code in self.question_timers:
-                del self.question_timers[game_code]
-            if game_code in self.auto_next_timers:
-                del self.auto_next_timers[game_code]
-
-            old = game
-            self.games[game_code] = {
-                "title": old["title"],
-                "status": "waiting",
-                "players": [],
-                "current_question": 0,
-                "scores": {},
-                "created_at": datetime.now().isoformat(),
-                "host_connected": False,
-                "question_active": False,
-                "answers": {},
-                "question_start_time": None,
-                "question_end_time": None,
-                "server_start_time": None,
-                "server_time_limit": 0,
-                "results_shown": False,
-                "total_questions": old["total_questions"]
-            }
-            self.player_scores[game_code] = {}
+        self.outbox = Outbox(lambda room: socketio.start_background_task(self.flush, room))
+
+    def flush(self, room):
+        payload = self.outbox.take(room)
+        if payload is not None:
+            socketio.emit('message', payload, room=room)
+
+    def send(self, payload, room):
+        self.outbox.put(payload, room)
+
+    def send_optional(self, payload, room):
+        # Необязательный трафик (статистика, синхронизация таймера) отбрасываем под нагрузкой
+        if load_monitor.level >= LoadMonitor.ELEVATED:
+            return
+        self.outbox.put(payload, room)
+
+    def join(self, sid, room):
+        join_room(room, sid=sid, namespace='/')
+
+    def leave(self, sid, room):
+        leave_room(room, sid=sid, namespace='/')
+
+    def spawn(self, phase):
+        return socketio.start_background_task(self.run_phase, phase)
+
+    @staticmethod
+    def run_phase(phase):
+        for delay in phase:
+            socketio.sleep(delay)
 
+    def question_revealed(self, game_code, game):
+        publish_spectator_question(game_code, game)
 
-game_manager = GameManager()
+
+engine = GameEngine(game_manager, app.config, GeventTransport())
 
 
 HTML_TEMPLATE = """
@@ -163,6 +222,8 @@ HTML_TEMPLATE = """
         .player-item { background: #f8f9fa; padding: 15px; margin: 5px 0; border-radius: 8px; display: flex; justify-content: space-between; align-items: center; border-left: 4px solid #667eea; }
         .question-container { text-align: center; padding: 40px 20px; }
         .question-text { font-size: 28px; margin-bottom: 30px; color: #333; }
+        .question-media img { max-width: 100%; max-height: 400px; border-radius: 10px; margin-bottom: 20px; }
+        .question-media audio { width: 100%; margin-bottom: 20px; }
         .options-grid { display: grid; grid-template-columns: repeat(2, 1fr); gap: 20px; margin: 30px 0; }
         .option-btn { padding: 25px; font-size: 18px; font-weight: 600; border: none; border-radius: 12px; cursor: pointer; transition: all 0.2s; color: white; }
         .option-btn:hover:not(:disabled) { transform: scale(1.05); box-shadow: 0 10px 20px rgba(0,0,0,0.2); }
@@ -182,8 +243,14 @@ HTML_TEMPLATE = """
         .progress-fill { height: 100%; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); transition: width 0.3s; }
         .auto-next-timer { font-size: 24px; text-align: center; margin: 20px 0; padding: 15px; background: #17a2b8; color: white; border-radius: 10px; }
         .error-message { color: #dc3545; background: #f8d7da; border: 1px solid #f5c6cb; padding: 10px; border-radius: 5px; margin: 10px 0; }
+        .quiz-item { background: #f8f9fa; padding: 15px; margin: 5px 0; border-radius: 8px; display: flex; justify-content: space-between; align-items: center; border-left: 4px solid #28a745; }
+        .pagination { text-align: center; margin: 15px 0; }
+        .histogram-row { display: flex; align-items: center; margin: 8px 0; font-size: 22px; }
+        .histogram-label { flex: 0 0 40%; text-align: left; padding-right: 10px; }
+        .histogram-bar { height: 36px; border-radius: 8px; color: white; padding: 4px 10px; min-width: 40px; transition: width 0.5s; }
+        .console-game { background: #f8f9fa; padding: 12px 15px; margin: 5px 0; border-radius: 8px; display: flex; justify-content: space-between; align-items: center; border-left: 4px solid #667eea; cursor: pointer; }
         .correct-answer-marker { background-color: #d4edda; border-left: 5px solid #28a745; padding: 10px; margin: 10px 0; border-radius: 5px; }
-        #studentView, #teacherView, #createGameView, #joinGameView, #waitingView, #questionView, #resultsView, #gameOverView { display: none; }
+        #studentView, #teacherView, #createGameView, #libraryView, #consoleView, #spectatorJoinView, #spectatorView, #joinGameView, #waitingView, #questionView, #resultsView, #gameOverView { display: none; }
     </style>
 </head>
 <body>
@@ -198,13 +265,55 @@ HTML_TEMPLATE = """
                     <p style="margin: 20px 0 40px;">Создайте или присоединитесь к игре</p>
                     <button class="btn" onclick="showView('teacherView')">👨‍🏫 Я учитель</button>
                     <button class="btn" onclick="showView('studentView')">👨‍🎓 Я ученик</button>
+                    <button class="btn btn-secondary" onclick="showView('spectatorJoinView')">📺 Зритель</button>
+                </div>
+            </div>
+
+            <!-- Консоль нескольких игр -->
+            <div id="consoleView">
+                <h2>Консоль учителя</h2>
+                <div class="input-group">
+                    <label>Коды игр (через запятую или пробел):</label>
+                    <input type="text" id="consoleCodes" style="text-transform: uppercase;">
+                </div>
+                <button class="btn btn-success" onclick="openConsole()">🖥 Следить</button>
+                <div id="consoleGames"></div>
+                <div id="consoleDetail" class="hidden"></div>
+                <button class="btn" onclick="backToMain()">← В главное меню</button>
+            </div>
+
+            <!-- Вход зрителя -->
+            <div id="spectatorJoinView">
+                <h2>Смотреть игру</h2>
+                <div class="input-group">
+                    <label>Код игры:</label>
+                    <input type="text" id="spectatorGameCode" maxlength="{{ code_length }}" style="text-transform: uppercase;">
                 </div>
+                <button class="btn btn-success" onclick="watchGame()">📺 Смотреть</button>
+                <button class="btn" onclick="showView('mainMenuView')">← Назад</button>
+            </div>
+
+            <!-- Большой экран -->
+            <div id="spectatorView">
+                <h2 id="spectatorTitle"></h2>
+                <div class="question-counter" id="spectatorCounter"></div>
+                <div class="question-container">
+                    <div class="synchronized-timer" id="spectatorTimer">--</div>
+                    <div class="question-text" id="spectatorQuestion">Ожидание начала игры...</div>
+                    <div class="question-media" id="spectatorMedia"></div>
+                    <div id="spectatorOptions"></div>
+                    <p id="spectatorAnswers"></p>
+                </div>
+                <div class="leaderboard" id="spectatorLeaderboard"></div>
+                <button class="btn" onclick="backToMain()">← В главное меню</button>
             </div>
 
             <!-- Меню учителя -->
             <div id="teacherView">
                 <h2>Панель учителя</h2>
                 <button class="btn" onclick="showView('createGameView')">🎮 Создать новую игру</button>
+                <button class="btn" onclick="showView('libraryView')">📚 Библиотека викторин</button>
+                <button class="btn" onclick="showView('consoleView')">🖥 Консоль нескольких игр</button>
                 <button class="btn btn-secondary" onclick="showView('mainMenuView')">← Назад</button>
             </div>
 
@@ -218,6 +327,24 @@ HTML_TEMPLATE = """
                 <div id="questionsContainer"></div>
                 <button class="btn btn-secondary" onclick="addQuestion()">➕ Добавить вопрос</button>
                 <button class="btn btn-success" onclick="createGame()">🚀 Создать игру</button>
+                <button class="btn btn-secondary" onclick="saveQuiz()">💾 Сохранить в библиотеку</button>
+                <button class="btn" onclick="showView('teacherView')">← Назад</button>
+            </div>
+
+            <!-- Библиотека викторин -->
+            <div id="libraryView">
+                <h2>Библиотека викторин</h2>
+                <div class="input-group">
+                    <input type="text" id="librarySearch" placeholder="Поиск по вопросам и вариантам" oninput="searchLibrary()">
+                </div>
+                <div class="input-group">
+                    <label>Импорт банка вопросов (CSV, JSON, NDJSON):</label>
+                    <input type="file" id="importFile" accept=".csv,.json,.ndjson,.jsonl">
+                </div>
+                <button class="btn btn-secondary" onclick="importQuizFile()">📥 Импортировать</button>
+                <div id="importReport"></div>
+                <ul class="players-list" id="libraryList"></ul>
+                <div class="pagination" id="libraryPagination"></div>
                 <button class="btn" onclick="showView('teacherView')">← Назад</button>
             </div>
 
@@ -268,7 +395,7 @@ HTML_TEMPLATE = """
                 <h2>Присоединиться к игре</h2>
                 <div class="input-group">
                     <label>Код игры:</label>
-                    <input type="text" id="studentGameCode" placeholder="например, ABC123" maxlength="6" style="text-transform: uppercase;">
+                    <input type="text" id="studentGameCode" placeholder="например, {{ code_example }}" maxlength="{{ code_length }}" style="text-transform: uppercase;">
                 </div>
                 <div class="input-group">
                     <label>Название команды:</label>
@@ -296,6 +423,7 @@ HTML_TEMPLATE = """
                 <div class="question-container">
                     <div class="synchronized-timer" id="questionTimer">30</div>
                     <div class="question-text" id="questionText"></div>
+                    <div class="question-media" id="questionMedia"></div>
                     <div class="options-grid" id="optionsGrid"></div>
                     <div id="questionStatusStudent" class="status-message status-active">Осталось времени...</div>
                     <p id="answerStatus"></p>
@@ -317,6 +445,10 @@ HTML_TEMPLATE = """
                     <h1>🎉 Игра завершена! 🎉</h1>
                     <div class="winner" id="winnerName"></div>
                     <div id="finalLeaderboard"></div>
+                    <div id="exportLinks" class="hidden">
+                        <a class="btn btn-secondary" id="exportCsvLink" href="#">📥 Результаты (CSV)</a>
+                        <a class="btn btn-secondary" id="exportNdjsonLink" href="#">📥 Результаты (NDJSON)</a>
+                    </div>
                     <button class="btn" onclick="showView('mainMenuView')">← В главное меню</button>
                 </div>
             </div>
@@ -336,6 +468,15 @@ HTML_TEMPLATE = """
         let serverStartTime = null;
         let serverTimeLimit = 0;
         let autoNextInterval = null;
+        let libraryPage = 1;
+        let stagedQuestion = null;
+        let clockOffset = 0;
+        let shuffleSeed = null;
+        let spectatorQuestion = null;
+        const preloadedMedia = {};
+        let playerSlot = null;
+        let librarySearchTimeout = null;
+        let consoleSelected = null;
 
         function showView(viewId) {
             document.querySelectorAll('[id$="View"]').forEach(v => {
@@ -380,6 +521,11 @@ HTML_TEMPLATE = """
                 document.getElementById('questionsContainer').innerHTML = '';
                 addQuestion();
             }
+
+            if (viewId === 'libraryView') {
+                document.getElementById('librarySearch').value = '';
+                loadLibrary(1);
+            }
         }
 
         function resetGameState() {
@@ -390,10 +536,14 @@ HTML_TEMPLATE = """
             answerSubmitted = false;
             serverStartTime = null;
             serverTimeLimit = 0;
+            stagedQuestion = null;
+            shuffleSeed = null;
+            playerSlot = null;
             if (serverTimeUpdateInterval) clearInterval(serverTimeUpdateInterval);
             if (autoNextInterval) clearInterval(autoNextInterval);
             serverTimeUpdateInterval = null;
             autoNextInterval = null;
+            document.getElementById('exportLinks').classList.add('hidden');
         }
 
         function backToMain() {
@@ -421,17 +571,18 @@ HTML_TEMPLATE = """
                 <div class="input-group"><label>Вариант 3</label><input type="text" id="option3_${index}" value="${index * 2 + 1}"></div>
                 <div class="input-group"><label>Вариант 4</label><input type="text" id="option4_${index}" value="${index * 3}"></div>
                 <div class="input-group"><label>Время на вопрос (секунд)</label><input type="number" id="time_${index}" value="30" min="5" max="120"></div>
+                <div class="input-group"><label>Картинка или аудио (необязательно)</label><input type="file" id="media_${index}" accept="image/*,audio/*" onchange="uploadMedia(this)"></div>
                 <button class="btn btn-danger" onclick="this.parentElement.remove()">❌ Удалить</button>
             `;
             container.appendChild(div);
         }
 
-        function createGame() {
+        function collectQuiz() {
             const title = document.getElementById('gameTitle').value;
-            if (!title) { alert('Введите название игры'); return; }
+            if (!title) { alert('Введите название игры'); return null; }
             const questions = [];
             const containers = document.querySelectorAll('#questionsContainer > div');
-            if (containers.length === 0) { alert('Добавьте хотя бы один вопрос'); return; }
+            if (containers.length === 0) { alert('Добавьте хотя бы один вопрос'); return null; }
             for (let i = 0; i < containers.length; i++) {
                 const idx = i + 1;
                 const qText = document.getElementById(`question_${idx}`)?.value;
@@ -440,19 +591,117 @@ HTML_TEMPLATE = """
                 const o3 = document.getElementById(`option3_${idx}`)?.value;
                 const o4 = document.getElementById(`option4_${idx}`)?.value;
                 if (!qText || !o1 || !o2 || !o3 || !o4) {
-                    alert(`Заполните все поля для вопроса ${idx}`); return;
+                    alert(`Заполните все поля для вопроса ${idx}`); return null;
                 }
                 questions.push({
                     text: qText,
                     options: [o1, o2, o3, o4],
                     correct_answer: 0,
-                    time_limit: parseInt(document.getElementById(`time_${idx}`).value) || 30
+                    time_limit: parseInt(document.getElementById(`time_${idx}`).value) || 30,
+                    media: document.getElementById(`media_${idx}`)?.dataset.mediaId || undefined
                 });
             }
+            return { title, questions };
+        }
+
+        function uploadMedia(input) {
+            delete input.dataset.mediaId;
+            const file = input.files[0];
+            if (!file) return;
+            fetch('/api/media', { method: 'POST', headers: {'Content-Type': file.type}, body: file })
+            .then(r => r.json())
+            .then(data => {
+                if (data.success) input.dataset.mediaId = data.media.id;
+                else { alert(data.message); input.value = ''; }
+            })
+            .catch(err => { console.error(err); alert('Ошибка загрузки файла'); });
+        }
+
+        function createGame() {
+            const quiz = collectQuiz();
+            if (quiz) startHostedGame(quiz);
+        }
+
+        function saveQuiz() {
+            const quiz = collectQuiz();
+            if (!quiz) return;
+            fetch('/api/quizzes', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify(quiz)
+            })
+            .then(r => r.json())
+            .then(data => alert(data.success ? 'Викторина сохранена в библиотеку' : data.message))
+            .catch(err => { console.error(err); alert('Ошибка сохранения'); });
+        }
+
+        function importQuizFile() {
+            const file = document.getElementById('importFile').files[0];
+            if (!file) { alert('Выберите файл'); return; }
+            const title = file.name.replace(/[.][^.]+$/, '');
+            const report = document.getElementById('importReport');
+            report.textContent = 'Импорт...';
+            fetch(`/api/quizzes/import?title=${encodeURIComponent(title)}`, {
+                method: 'POST',
+                headers: {'Content-Type': file.name.match(/[.](ndjson|jsonl)$/i) ? 'application/x-ndjson' :
+                    file.name.match(/[.]json$/i) ? 'application/json' : 'text/csv'},
+                body: file
+            })
+            .then(r => r.json())
+            .then(data => {
+                let html = `<p>Импортировано вопросов: ${data.imported}, ошибок: ${data.error_count}</p>`;
+                if (data.message) html += `<div class="error-message">${data.message}</div>`;
+                data.errors.forEach(e => { html += `<div class="error-message">Строка ${e.row}: ${e.message}</div>`; });
+                report.innerHTML = html;
+                loadLibrary(1);
+            })
+            .catch(err => { console.error(err); report.textContent = 'Ошибка импорта'; });
+        }
+
+        function searchLibrary() {
+            if (librarySearchTimeout) clearTimeout(librarySearchTimeout);
+            librarySearchTimeout = setTimeout(() => loadLibrary(1), 300);
+        }
+
+        function loadLibrary(page) {
+            libraryPage = page;
+            const q = document.getElementById('librarySearch').value.trim();
+            fetch(`/api/quizzes?page=${page}&q=${encodeURIComponent(q)}`)
+            .then(r => r.json())
+            .then(data => {
+                const list = document.getElementById('libraryList');
+                list.innerHTML = '';
+                if (!data.items.length) list.innerHTML = '<li class="quiz-item">Ничего не найдено</li>';
+                data.items.forEach(quiz => {
+                    const li = document.createElement('li');
+                    li.className = 'quiz-item';
+                    const name = document.createElement('span');
+                    name.textContent = `${quiz.title} (${quiz.question_count} вопр.)`;
+                    const btn = document.createElement('button');
+                    btn.className = 'btn btn-success';
+                    btn.textContent = '🚀 Создать игру';
+                    btn.onclick = () => startHostedGame({ quiz_id: quiz.id });
+                    li.appendChild(name);
+                    li.appendChild(btn);
+                    list.appendChild(li);
+                });
+                const pages = Math.max(1, Math.ceil(data.total / data.per_page));
+                const pagination = document.getElementById('libraryPagination');
+                pagination.innerHTML = '';
+                if (pages > 1) {
+                    if (page > 1) pagination.innerHTML += `<button class="btn btn-secondary" onclick="loadLibrary(${page - 1})">←</button>`;
+                    pagination.innerHTML += ` ${page} / ${pages} `;
+                    if (page < pages) pagination.innerHTML += `<button class="btn btn-secondary" onclick="loadLibrary(${page + 1})">→</button>`;
+                }
+            })
+            .catch(err => console.error(err));
+        }
+
+        function startHostedGame(payload) {
             fetch('/api/create_game', {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({ title, questions })
+                body: JSON.stringify(payload)
             })
             .then(r => r.json())
             .then(data => {
@@ -518,11 +767,15 @@ HTML_TEMPLATE = """
             socket = io();
             socket.on('connect', () => {
                 if (role === 'teacher') socket.emit('teacher_join', { game_code: code });
+                else if (role === 'spectator') socket.emit('spectator_join', { game_code: code });
+                else if (role === 'console') socket.emit('host_subscribe', { game_codes: code });
                 else socket.emit('player_join', { game_code: code, player_name: name });
             });
             socket.on('message', handleSocketMessage);
+            socket.on('spectator', frame => handleSpectatorFrame(JSON.parse(frame)));
+            socket.on('console', handleConsoleFrame);
             socket.on('disconnect', () => {
-                if (['waitingView','questionView','resultsView'].includes(currentView)) {
+                if (['waitingView','questionView','resultsView','spectatorView','consoleView'].includes(currentView)) {
                     setTimeout(() => connectSocket(code, name, role), 3000);
                 }
             });
@@ -530,6 +783,9 @@ HTML_TEMPLATE = """
 
         function handleSocketMessage(data) {
             switch(data.type) {
+                case 'batch':
+                    data.messages.forEach(handleSocketMessage);
+                    break;
                 case 'player_joined':
                     updatePlayersList(data.players);
                     if (currentView === 'waitingView') updateWaitingPlayers(data.players);
@@ -547,6 +803,17 @@ HTML_TEMPLATE = """
                 case 'show_question':
                     showQuestion(data.question);
                     break;
+                case 'player_info':
+                    shuffleSeed = data.seed;
+                    playerSlot = data.slot;
+                    break;
+                case 'stage_question':
+                    stagedQuestion = { id: data.stage_id, payload: data.payload };
+                    if (data.preload) preloadMedia(data.preload);
+                    break;
+                case 'reveal_question':
+                    revealQuestion(data);
+                    break;
                 case 'server_time_update':
                     handleServerTimeUpdate(data.server_time, data.time_limit, data.start_time);
                     break;
@@ -567,6 +834,7 @@ HTML_TEMPLATE = """
                     break;
                 case 'game_over':
                     showFinalResults(data.final_results);
+                    if (!teamName && data.run_id) showExportLinks(data.run_id);
                     break;
                 case 'game_ended':
                     if (socket) socket.disconnect();
@@ -599,6 +867,125 @@ HTML_TEMPLATE = """
             }
         }
 
+        function openConsole() {
+            const codes = document.getElementById('consoleCodes').value.toUpperCase().split(/[ ,;]+/).filter(c => c);
+            if (!codes.length) { alert('Введите коды игр'); return; }
+            consoleSelected = null;
+            document.getElementById('consoleDetail').classList.add('hidden');
+            connectSocket(codes, null, 'console');
+        }
+
+        function handleConsoleFrame(frame) {
+            if (frame.type === 'console_detail') {
+                renderConsoleDetail(frame);
+                return;
+            }
+            const phases = { waiting: 'ожидание', question: 'вопрос идёт', results: 'результаты', finished: 'завершена' };
+            const container = document.getElementById('consoleGames');
+            container.innerHTML = '';
+            if (frame.missing && frame.missing.length) {
+                const warn = document.createElement('div');
+                warn.className = 'error-message';
+                warn.textContent = 'Не найдены: ' + frame.missing.join(', ');
+                container.appendChild(warn);
+            }
+            frame.games.forEach(g => {
+                const row = document.createElement('div');
+                row.className = 'console-game';
+                const left = g.time_left !== undefined ? ` · ⏱ ${g.time_left}` : '';
+                row.innerHTML = `<div><strong>${g.game_code}</strong> ${g.title}<br>` +
+                    `<small>${phases[g.phase] || g.phase} · В: ${g.question_number}/${g.total_questions}${left}</small></div>` +
+                    `<div class="player-score">${g.answers_received}/${g.total_players}</div>`;
+                row.onclick = () => {
+                    consoleSelected = g.game_code;
+                    socket.emit('console_detail', { game_code: g.game_code });
+                };
+                container.appendChild(row);
+            });
+            // Открытую карточку игры обновляем вместе со сводкой
+            if (consoleSelected && frame.games.some(g => g.game_code === consoleSelected)) {
+                socket.emit('console_detail', { game_code: consoleSelected });
+            }
+        }
+
+        function renderConsoleDetail(frame) {
+            if (frame.game_code !== consoleSelected) return;
+            const detail = document.getElementById('consoleDetail');
+            let html = `<h3>${frame.game_code}: ${frame.title}</h3>`;
+            html += `<p>Ответили: ${frame.answers_received}/${frame.total_players}</p>`;
+            frame.players.forEach(p => {
+                html += `<div class="player-item">${p.connected ? '🟢' : '⚪'} ${p.name} ${p.answered ? '✅' : ''}` +
+                    `<span class="player-score">${p.score} очков</span></div>`;
+            });
+            detail.innerHTML = html;
+            detail.classList.remove('hidden');
+        }
+
+        function watchGame() {
+            gameCode = document.getElementById('spectatorGameCode').value.trim().toUpperCase();
+            if (!gameCode) { alert('Введите корректный код игры'); return; }
+            spectatorQuestion = null;
+            showView('spectatorView');
+            connectSocket(gameCode, null, 'spectator');
+        }
+
+        function handleSpectatorFrame(frame) {
+            if (frame.type === 'question') {
+                spectatorQuestion = frame;
+                document.getElementById('spectatorQuestion').textContent = frame.text;
+                document.getElementById('spectatorCounter').textContent = `В: ${frame.question_number}/${frame.total_questions}`;
+                const media = document.getElementById('spectatorMedia');
+                media.innerHTML = '';
+                if (frame.media) {
+                    const el = document.createElement(frame.media.kind === 'image' ? 'img' : 'audio');
+                    el.src = frame.media.url;
+                    if (frame.media.kind === 'audio') el.controls = true;
+                    media.appendChild(el);
+                }
+                renderSpectatorOptions(null, null);
+                return;
+            }
+            document.getElementById('spectatorTitle').textContent = frame.title;
+            document.getElementById('spectatorAnswers').textContent = `Ответили: ${frame.answers_received}/${frame.total_players}`;
+            if (frame.question_active) {
+                clockOffset = frame.server_time - Date.now();
+                const left = Math.max(0, Math.min(frame.time_limit, Math.floor(frame.time_limit - (serverNow() - frame.start_time) / 1000)));
+                document.getElementById('spectatorTimer').textContent = left;
+            } else {
+                document.getElementById('spectatorTimer').textContent = '--';
+                if (frame.histogram) renderSpectatorOptions(frame.histogram, frame.correct_answer);
+            }
+            if (frame.status === 'finished') document.getElementById('spectatorQuestion').textContent = '🎉 Игра завершена!';
+            let lb = '<h3>Таблица лидеров</h3>';
+            frame.leaderboard.forEach((p, i) => {
+                lb += `<div class="leaderboard-item">${i+1}. ${p.name} <span class="player-score">${p.score} очков</span></div>`;
+            });
+            document.getElementById('spectatorLeaderboard').innerHTML = lb;
+        }
+
+        function renderSpectatorOptions(histogram, correct) {
+            const container = document.getElementById('spectatorOptions');
+            container.innerHTML = '';
+            if (!spectatorQuestion) return;
+            const colors = ['#FF6B6B', '#4ECDC4', '#FFD166', '#118AB2'];
+            const total = histogram ? Math.max(1, histogram.reduce((a, b) => a + b, 0)) : 1;
+            spectatorQuestion.options.forEach((opt, i) => {
+                const row = document.createElement('div');
+                row.className = 'histogram-row';
+                const label = document.createElement('div');
+                label.className = 'histogram-label';
+                label.textContent = `${String.fromCharCode(65+i)}: ${opt}${correct === i ? ' ✅' : ''}`;
+                const bar = document.createElement('div');
+                bar.className = 'histogram-bar';
+                bar.style.background = colors[i % colors.length];
+                bar.style.width = histogram ? `${(histogram[i] / total) * 55}%` : '0';
+                bar.textContent = histogram ? histogram[i] : '';
+                row.appendChild(label);
+                row.appendChild(bar);
+                container.appendChild(row);
+            });
+        }
+
         function startGame() {
             if (socket && socket.connected) {
                 socket.emit('host_message', { type: 'start_game', game_code: gameCode });
@@ -632,20 +1019,100 @@ HTML_TEMPLATE = """
             answerSubmitted = false;
             showView('questionView');
             document.getElementById('questionText').textContent = question.text;
+            showQuestionMedia(question.media);
             document.getElementById('studentQuestionCounter').textContent = `В: ${question.question_number}/${question.total_questions}`;
             document.getElementById('answerStatus').textContent = '';
             document.getElementById('questionStatusStudent').textContent = 'Осталось времени...';
             const grid = document.getElementById('optionsGrid');
             grid.innerHTML = '';
-            question.options.forEach((opt, idx) => {
+            const order = playerSlot === null ? question.options.map((_, i) => i)
+                : optionPermutation(shuffleSeed, playerSlot, question.question_number - 1, question.options.length);
+            order.forEach((optIdx, idx) => {
                 const btn = document.createElement('button');
                 btn.className = `option-btn option-${idx+1}`;
-                btn.textContent = `${String.fromCharCode(65+idx)}: ${opt}`;
+                btn.textContent = `${String.fromCharCode(65+idx)}: ${question.options[optIdx]}`;
                 btn.onclick = () => selectAnswer(idx);
                 grid.appendChild(btn);
             });
         }
 
+        function preloadMedia(media) {
+            if (preloadedMedia[media.url]) return preloadedMedia[media.url];
+            let el;
+            if (media.kind === 'image') {
+                el = new Image();
+            } else {
+                el = document.createElement('audio');
+                el.controls = true;
+                el.preload = 'auto';
+            }
+            el.src = media.url;
+            preloadedMedia[media.url] = el;
+            return el;
+        }
+
+        function showQuestionMedia(media) {
+            const container = document.getElementById('questionMedia');
+            container.innerHTML = '';
+            if (!media) return;
+            const el = preloadMedia(media);
+            delete preloadedMedia[media.url];
+            container.appendChild(el);
+            if (media.kind === 'audio') el.play().catch(() => {});
+        }
+
+        function optionPermutation(seed, slot, qIdx, n) {
+            // mulberry32 + Фишер–Йетс, тот же алгоритм на сервере (option_permutation)
+            let a = (seed ^ Math.imul(slot + 1, 0x9E3779B1) ^ Math.imul(qIdx + 1, 0x85EBCA77)) | 0;
+            const order = [];
+            for (let i = 0; i < n; i++) order.push(i);
+            for (let i = n - 1; i > 0; i--) {
+                a = (a + 0x6D2B79F5) | 0;
+                let t = Math.imul(a ^ (a >>> 15), 1 | a);
+                t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t;
+                const j = ((t ^ (t >>> 14)) >>> 0) % (i + 1);
+                [order[i], order[j]] = [order[j], order[i]];
+            }
+            return order;
+        }
+
+        function serverNow() {
+            return Date.now() + clockOffset;
+        }
+
+        function revealPayload(payload, keyHex) {
+            // xorshift128 — тот же генератор, что keystream_xor на сервере
+            const data = Uint8Array.from(atob(payload), c => c.charCodeAt(0));
+            const s = new Uint32Array(4);
+            for (let i = 0; i < 4; i++) {
+                s[i] = parseInt(keyHex.substr(i * 8, 8).match(/../g).reverse().join(''), 16);
+            }
+            for (let i = 0; i < data.length; i += 4) {
+                let t = s[3];
+                const x = s[0];
+                s[3] = s[2]; s[2] = s[1]; s[1] = x;
+                t ^= t << 11;
+                t ^= t >>> 8;
+                s[0] = t ^ x ^ (x >>> 19);
+                for (let j = 0; j < 4 && i + j < data.length; j++) data[i + j] ^= (s[0] >>> (8 * j)) & 255;
+            }
+            return JSON.parse(new TextDecoder().decode(data));
+        }
+
+        function revealQuestion(data) {
+            clockOffset = data.server_time - Date.now();
+            if (!stagedQuestion || stagedQuestion.id !== data.stage_id) {
+                if (socket && socket.connected) socket.emit('request_question', { game_code: gameCode });
+                return;
+            }
+            const question = revealPayload(stagedQuestion.payload, data.key);
+            stagedQuestion = null;
+            setTimeout(() => {
+                showQuestion(question);
+                handleServerTimeUpdate(data.server_time, data.time_limit, data.start_time);
+            }, Math.max(0, data.start_time - serverNow()));
+        }
+
         function disableQuestionButtons() {
             document.querySelectorAll('.option-btn').forEach(b => b.disabled = true);
         }
@@ -659,14 +1126,7 @@ HTML_TEMPLATE = """
             });
             if (socket && socket.connected) {
                 answerSubmitted = true;
-                const elapsed = (Date.now() - serverStartTime) / 1000;
-                const timeLeft = Math.max(0, Math.floor(serverTimeLimit - elapsed));
-                socket.emit('submit_answer', {
-                    game_code: gameCode,
-                    player_name: teamName,
-                    answer: index,
-                    time_left: timeLeft
-                });
+                socket.emit('submit_answer', { game_code: gameCode, answer: index });
                 document.getElementById('answerStatus').textContent = 'Ответ отправлен!';
                 document.getElementById('answerStatus').style.color = '#28a745';
                 disableQuestionButtons();
@@ -674,13 +1134,14 @@ HTML_TEMPLATE = """
         }
 
         function handleServerTimeUpdate(serverTime, timeLimit, startTime) {
+            if (serverTime) clockOffset = serverTime - Date.now();
             serverStartTime = startTime;
             serverTimeLimit = timeLimit;
             if (serverTimeUpdateInterval) clearInterval(serverTimeUpdateInterval);
             const update = () => {
                 if (!serverStartTime || !serverTimeLimit) return;
-                const elapsed = (Date.now() - serverStartTime) / 1000;
-                let left = Math.max(0, Math.floor(serverTimeLimit - elapsed));
+                const elapsed = (serverNow() - serverStartTime) / 1000;
+                let left = Math.max(0, Math.min(serverTimeLimit, Math.floor(serverTimeLimit - elapsed)));
                 const timer = document.getElementById('questionTimer');
                 const hostTimer = document.getElementById('hostTimer');
                 if (timer) timer.textContent = left;
@@ -762,6 +1223,13 @@ HTML_TEMPLATE = """
             }
         }
 
+        function showExportLinks(runId) {
+            const base = `/api/game/${gameCode}/export?run=${encodeURIComponent(runId)}`;
+            document.getElementById('exportCsvLink').href = `${base}&format=csv`;
+            document.getElementById('exportNdjsonLink').href = `${base}&format=ndjson`;
+            document.getElementById('exportLinks').classList.remove('hidden');
+        }
+
         function showFinalResults(results) {
             showView('gameOverView');
             if (results.length) {
@@ -788,19 +1256,203 @@ HTML_TEMPLATE = """
 
 
 
+@app.before_request
+def start_load_monitor():
+    load_monitor.ensure_started()
+
+
+@app.after_request
+def add_load_header(response):
+    response.headers['X-Load-Level'] = str(load_monitor.level)
+    return response
+
+
+@app.before_request
+def record_api_call():
+    if traffic_recorder is None or not should_record(request.path):
+        return
+    capture = request.is_json and should_capture_body(request.path, request.content_length)
+    body = request.get_data(cache=True) if capture else None
+    traffic_recorder.http_call(request.method, request.path, request.query_string.decode('latin-1'), body,
+                               request.content_length or 0)
+
+
+@app.after_request
+def record_game_code(response):
+    if traffic_recorder is not None and request.path == '/api/create_game' and response.status_code == 200:
+        traffic_recorder.game_created(response.get_json()['game_code'])
+    return response
+
+
+def overloaded_response():
+    retry_after = app.config['LOAD_RETRY_AFTER']
+    return jsonify(success=False, message='Сервер перегружен, попробуйте позже',
+                   retry_after=retry_after), 503, {'Retry-After': str(retry_after)}
+
+
+@app.route('/api/load')
+def api_load():
+    return jsonify(success=True, load=load_monitor.status())
+
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = app.config['ADMIN_TOKEN']
+        given = request.headers.get('X-Admin-Token') or request.args.get('token')
+        if not token or given != token:
+            return jsonify(success=False, message='Доступ запрещён'), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    # Страница отрисована и сжата один раз в create_app
+    if request.if_none_match.contains(index_page['etag']):
+        return Response(status=304, headers={'ETag': '"%s"' % index_page['etag']})
+    headers = {'ETag': '"%s"' % index_page['etag'], 'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip']:
+        headers['Content-Encoding'] = 'gzip'
+        return Response(index_page['gzip'], mimetype='text/html', headers=headers)
+    return Response(index_page['body'], mimetype='text/html', headers=headers)
 
 
 @app.route('/api/create_game', methods=['POST'])
 def api_create_game():
-    data = request.json
-    game_code = str(uuid.uuid4())[:6].upper()
-    while game_code in game_manager.games:
-        game_code = str(uuid.uuid4())[:6].upper()
-    game_manager.create_game(game_code, data['title'], data['questions'])
-    return jsonify(success=True, game_code=game_code)
+    if load_monitor.level >= LoadMonitor.HIGH:
+        return overloaded_response()
+    body, status = engine.create_game(request.get_json(silent=True) or {}, quiz_library)
+    return jsonify(body), status
+
+
+@app.route('/api/quizzes')
+def api_list_quizzes():
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    query = request.args.get('q', '').strip()
+    return jsonify(success=True, **quiz_library.list_quizzes(page, per_page, query))
+
+
+@app.route('/api/quizzes', methods=['POST'])
+def api_save_quiz():
+    data = request.get_json(silent=True) or {}
+    title = str(data.get('title', '')).strip()
+    if not title:
+        return jsonify(success=False, message='Введите название игры'), 400
+    try:
+        questions = normalize_questions(data.get('questions'))
+    except QuizValidationError as e:
+        return jsonify(success=False, message=str(e)), 400
+    quiz_id = quiz_library.add_quiz(title, questions)
+    return jsonify(success=True, quiz_id=quiz_id)
+
+
+@app.route('/api/quizzes/import', methods=['POST'])
+def api_import_quiz():
+    if load_monitor.level >= LoadMonitor.HIGH:
+        return overloaded_response()
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    if upload is not None:
+        stream, filename, content_type = upload.stream, upload.filename, upload.mimetype
+    else:
+        stream, filename, content_type = request.stream, None, request.mimetype
+    fmt = detect_format(request.args.get('format'), filename, content_type)
+    if fmt not in FORMATS:
+        return jsonify(success=False, message='Неизвестный формат'), 400
+    title = request.args.get('title') or (request.form.get('title') if upload is not None else None)
+    title = (title or filename or '').strip()
+    if not title:
+        return jsonify(success=False, message='Введите название игры'), 400
+
+    batch_size = app.config['IMPORT_BATCH_SIZE']
+    max_errors = app.config['IMPORT_MAX_ERRORS']
+    quiz_id = quiz_library.create_quiz(title)
+    imported = 0
+    error_count = 0
+    errors = []
+    fatal = None
+    batch = []
+    # Викторина создана скрытой: при обрыве загрузки, ошибке кодировки или SQLite удаляем её,
+    # чтобы строка с ready = 0 не осталась навсегда
+    try:
+        try:
+            for row, raw in PARSERS[fmt](stream):
+                try:
+                    if raw is None:
+                        raise QuizValidationError('Некорректный JSON')
+                    batch.append(normalize_question(raw))
+                except QuizValidationError as e:
+                    error_count += 1
+                    if len(errors) < max_errors:
+                        errors.append({'row': row, 'message': str(e)})
+                    continue
+                if len(batch) >= batch_size:
+                    quiz_library.append_questions(quiz_id, title, batch, imported)
+                    imported += len(batch)
+                    batch = []
+                    socketio.sleep(0)
+        except (ImportFormatError, csv.Error) as e:
+            fatal = str(e)
+        if batch:
+            quiz_library.append_questions(quiz_id, title, batch, imported)
+            imported += len(batch)
+    except BaseException:
+        quiz_library.delete_quiz(quiz_id)
+        raise
+    if imported == 0:
+        quiz_library.delete_quiz(quiz_id)
+        quiz_id = None
+    else:
+        quiz_library.finish_quiz(quiz_id)
+    return jsonify(success=imported > 0, quiz_id=quiz_id, imported=imported, error_count=error_count,
+                   errors=errors, message=fatal or ('' if imported else 'Нет корректных вопросов')), \
+        200 if imported else 400
+
+
+@app.route('/api/media', methods=['POST'])
+def api_upload_media():
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    if upload is not None:
+        stream, mimetype = upload.stream, upload.mimetype
+    else:
+        stream, mimetype = request.stream, request.mimetype
+    try:
+        name = media_store.save(stream, mimetype)
+    except MediaError as e:
+        return jsonify(success=False, message=str(e)), 400
+    return jsonify(success=True, media={'id': name, 'url': '/media/' + name, 'kind': media_kind(name)})
+
+
+@app.route('/media/<name>')
+def serve_media(name):
+    path = media_store.path(name)
+    if not path:
+        return jsonify(success=False, message='Файл не найден'), 404
+    # Имя — хэш содержимого: файл никогда не меняется, кэшируем навсегда
+    etag = '"%s"' % name.split('.')[0]
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes', 'Cache-Control': 'public, max-age=31536000, immutable'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    size = os.path.getsize(path)
+    status, offset, length = media_range(request.headers.get('Range'), request.headers.get('If-Range'), etag, size)
+    if status == 416:
+        headers['Content-Range'] = 'bytes */%d' % size
+        return Response(status=416, headers=headers)
+    if status == 206:
+        headers['Content-Range'] = 'bytes %d-%d/%d' % (offset, offset + length - 1, size)
+    headers['Content-Length'] = str(length)
+    # MediaFile уходит серверу как есть: воркер из sendfile_worker отдаёт его через sendfile
+    return Response(MediaFile(path, offset, length), status=status, headers=headers,
+                    mimetype=EXTENSION_TYPES[name.rsplit('.', 1)[1]], direct_passthrough=True)
+
+
+@app.route('/api/quizzes/<int:quiz_id>')
+def api_get_quiz(quiz_id):
+    quiz = quiz_library.get_quiz(quiz_id)
+    if not quiz:
+        return jsonify(success=False, message='Викторина не найдена'), 404
+    return jsonify(success=True, quiz=quiz)
 
 
 @app.route('/api/join_game', methods=['POST'])
@@ -810,319 +1462,516 @@ def api_join_game():
     team_name = data.get('team_name', '').strip()
     if not game_code or not team_name:
         return jsonify(success=False, message='Не хватает данных'), 400
-    if game_manager.join_game(game_code, team_name):
-        return jsonify(success=True)
-    game = game_manager.get_game(game_code)
-    if not game:
-        return jsonify(success=False, message='Игра не найдена'), 404
-    if game['status'] != 'waiting':
-        return jsonify(success=False, message='Игра уже началась'), 400
-    return jsonify(success=False, message='Имя команды уже занято или игра недоступна'), 400
+    if load_monitor.level >= LoadMonitor.HIGH:
+        # Растягиваем волну подключений, не блокируя цикл событий
+        socketio.sleep(app.config['LOAD_JOIN_DELAY'] * (load_monitor.level - 1) * (1 + random.random()))
+    body, status = engine.join_game(game_code, team_name)
+    return jsonify(body), status
 
 
 @app.route('/api/game/<game_code>/status')
 def game_status(game_code):
-    game = game_manager.get_game(game_code.upper())
+    game_code = game_code.upper()
+    game = game_manager.get_game(game_code)
     if not game:
         return jsonify(success=False, message='Игра не найдена'), 404
-    return jsonify(success=True, game={
-        'title': game['title'],
-        'status': game['status'],
-        'players': game['players'],
-        'current_question': game['current_question'],
-        'total_questions': game.get('total_questions', 0)
+    fields = [f for f in request.args.get('fields', '').split(',') if f] or list(STATUS_FIELDS)
+    if any(f not in STATUS_FIELDS for f in fields):
+        return jsonify(success=False, message='Неизвестное поле'), 400
+    since = request.args.get('since', type=int)
+    if since is not None:
+        # Long-poll: ждём изменения на событии, не занимая цикл событий
+        timeout = max(0, min(request.args.get('timeout', 25, type=float), app.config['STATUS_LONG_POLL_MAX']))
+        event = game_manager.change_event(game_code, since)
+        if event is not None:
+            event.wait(timeout)
+        game = game_manager.get_game(game_code)
+        if not game:
+            return jsonify(success=False, message='Игра не найдена'), 404
+    version, etag, body = engine.status_body(game_code, game, fields)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(body)
+    response.set_etag(etag)
+    response.headers['X-Game-Version'] = str(version)
+    return response
+
+
+@app.route('/api/game/<game_code>/export')
+def api_export_results(game_code):
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify(success=False, message='Неизвестный формат'), 400
+    game_code = game_code.upper()
+    run_id = results_archive.find_run(game_code, request.args.get('run'))
+    if not run_id:
+        return jsonify(success=False, message='Результаты не найдены'), 404
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = 'results-%s-%s.%s' % (game_code, run_id[:8], fmt)
+    # Генератор отдаёт чанки и уступает цикл событий между ними
+    chunks = results_archive.iter_export(run_id, fmt, pause=lambda: socketio.sleep(0))
+    return Response(chunks, mimetype=mimetype, headers={
+        'Content-Disposition': 'attachment; filename=%s' % filename
     })
 
 
-sid_to_player = {}
+@app.route('/api/season/leaderboard')
+def api_season_leaderboard():
+    season = request.args.get('season', app.config['SEASON'])
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    return jsonify(success=True, season=season, **season_leaderboard.top(season, limit))
+
+
+@app.route('/api/season/team/<team>')
+def api_season_team(team):
+    season = request.args.get('season', app.config['SEASON'])
+    around = max(0, min(request.args.get('around', 5, type=int), 50))
+    standing = season_leaderboard.team(season, team.strip(), around)
+    if not standing:
+        return jsonify(success=False, message='Команда не найдена'), 404
+    return jsonify(success=True, season=season, standing=standing)
 
 
 @socketio.on('teacher_join')
 def handle_teacher_join(data):
-    game_code = data['game_code']
-    game = game_manager.get_game(game_code)
-    if not game:
-        emit('message', {'type': 'error', 'message': 'Игра не найдена'})
-        return
-    game['host_connected'] = True
-    join_room(game_code)
-    sid_to_player[request.sid] = (game_code, 'host')
-    emit('message', {'type': 'connected', 'game_code': game_code})
+    engine.teacher_join(request.sid, data)
 
 
 @socketio.on('player_join')
 def handle_player_join(data):
-    game_code = data['game_code']
-    player_name = data['player_name']
-    game = game_manager.get_game(game_code)
-    if not game:
-        emit('message', {'type': 'error', 'message': 'Игра не найдена'})
-        return
-    player = next((p for p in game['players'] if p['name'] == player_name), None)
-    if not player:
-        emit('message', {'type': 'error', 'message': 'Игрок не зарегистрирован'})
-        return
+    engine.player_join(request.sid, data)
 
-    player['connected'] = True
-    join_room(game_code)
-    sid_to_player[request.sid] = (game_code, player_name)
-
-    emit('message', {'type': 'player_joined', 'player': player_name, 'players': game['players']}, room=game_code)
-    if game['status'] == 'active' and game.get('question_active'):
-        questions = game_manager.questions[game_code]
-        q_idx = game['current_question']
-        if q_idx < len(questions):
-            q = questions[q_idx]
-            emit('message', {
-                'type': 'server_time_update',
-                'server_time': int(time.time() * 1000),
-                'time_limit': q['time_limit'],
-                'start_time': game.get('server_start_time', int(time.time() * 1000))
-            })
-            emit('message', {
-                'type': 'show_question',
-                'question': {
-                    'text': q['text'],
-                    'options': q['options'],
-                    'correct_answer': q['correct_answer'],
-                    'time_limit': q['time_limit'],
-                    'question_number': q_idx + 1,
-                    'total_questions': len(questions)
-                }
-            })
+
+@socketio.on('request_question')
+def handle_request_question(data):
+    engine.request_question(request.sid)
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     sid = request.sid
-    if sid in sid_to_player:
-        game_code, player_name = sid_to_player[sid]
-        if player_name == 'host':
-            game = game_manager.get_game(game_code)
-            if game:
-                game['host_connected'] = False
-        else:
-            game_manager.disconnect_player(game_code, player_name)
-            game = game_manager.get_game(game_code)
-            if game:
-                emit('message', {'type': 'player_left', 'player': player_name, 'players': game['players']},
-                     room=game_code)
-        del sid_to_player[sid]
+    if sid in spectators:
+        remove_spectator(sid)
+    remove_console(sid)
+    engine.disconnect(sid)
 
 
 @socketio.on('host_message')
 def handle_host_message(data):
-    game_code = data.get('game_code')
-    if not game_code:
-        emit('message', {'type': 'error', 'message': 'Нет кода игры'})
-        return
-    game = game_manager.get_game(game_code)
-    if not game:
-        emit('message', {'type': 'error', 'message': 'Игра не найдена'})
-        return
-    msg_type = data.get('type')
-    if msg_type == 'start_game':
-        if len(game['players']) == 0:
-            emit('message', {'type': 'error', 'message': 'Нет игроков'})
-            return
-        if game_manager.start_game(game_code):
-            game['status'] = 'active'
-            game['current_question'] = 0
-            emit('message', {'type': 'game_started', 'message': 'Игра начинается...'}, room=game_code)
-            socketio.start_background_task(show_question_to_all, game_code)
-    elif msg_type == 'show_question_results':
-        game['question_active'] = False
-        socketio.start_background_task(calculate_and_send_results, game_code, True)
-    elif msg_type == 'end_question_early':
-        game['question_active'] = False
-        socketio.start_background_task(calculate_and_send_results, game_code, True)
-    elif msg_type == 'end_game':
-        emit('message', {'type': 'game_ended'}, room=game_code)
-        socketio.sleep(0.5)
-        game_manager.reset_game(game_code)
+    engine.host_message(request.sid, data)
 
 
 @socketio.on('submit_answer')
 def handle_submit_answer(data):
-    game_code = data.get('game_code')
-    player_name = data.get('player_name')
-    answer_index = data.get('answer')
-    time_left = data.get('time_left')
-    if not game_code or not player_name:
-        emit('message', {'type': 'error', 'message': 'Не хватает данных'})
+    engine.submit_answer(request.sid, data)
+
+
+@socketio.on('relay_join')
+def handle_relay_join(data):
+    engine.relay_join(request.sid, data)
+
+
+@socketio.on('relay_event')
+def handle_relay_event(data):
+    engine.relay_event(request.sid, data)
+
+
+@socketio.on('relay_answers')
+def handle_relay_answers(data):
+    engine.relay_answers(request.sid, data)
+
+
+# ---------- Режим зрителя ----------
+# Зрители сидят в отдельной комнате и получают прореженный поток с фиксированной частотой,
+# поэтому их число не влияет на кадры игроков
+spectators = {}
+spectator_counts = {}
+# Игры, у которых уже идёт цикл рассылки: зритель, вернувшийся во время sleep, не запускает второй
+spectator_feeds = set()
+
+
+def spectator_room(game_code):
+    return game_code + ':spectators'
+
+
+@socketio.on('spectator_join')
+def handle_spectator_join(data):
+    if not isinstance(data, dict):
         return
+    game_code = str(data.get('game_code', '')).upper().strip()
     game = game_manager.get_game(game_code)
     if not game:
         emit('message', {'type': 'error', 'message': 'Игра не найдена'})
         return
-    if not game.get('question_active'):
-        emit('message', {'type': 'error', 'message': 'Время ответа истекло'})
-        return
-    player = next((p for p in game['players'] if p['name'] == player_name), None)
-    if not player:
-        emit('message', {'type': 'error', 'message': 'Игрок не найден'})
-        return
-    game['answers'][player_name] = {
-        'answer': answer_index,
-        'time_left': time_left,
-        'timestamp': time.time()
-    }
-    player['last_answer'] = answer_index
-    player['answer_time'] = time_left
-    emit('message', {'type': 'answer_received'})
-    # Обновить статистику для учителя
-    answers_received = len(game['answers'])
-    total_players = len([p for p in game['players'] if p['connected']])
-    emit('message', {
-        'type': 'question_stats_update',
-        'answers_received': answers_received,
-        'total_players': total_players
-    }, room=game_code)
-
-
-# ---------- Фоновые задачи ----------
-def show_question_to_all(game_code):
-    game = game_manager.get_game(game_code)
-    if not game: return
+    if request.sid in spectators:
+        remove_spectator(request.sid)
+    spectators[request.sid] = game_code
+    join_room(spectator_room(game_code))
+    spectator_counts[game_code] = spectator_counts.get(game_code, 0) + 1
+    if game_code not in spectator_feeds:
+        spectator_feeds.add(game_code)
+        socketio.start_background_task(spectator_feed, game_code)
+    if game.get('question_active'):
+        emit('spectator', spectator_question_frame(game_code, game))
+    emit('spectator', json.dumps(spectator_snapshot(game_code, game), ensure_ascii=False))
+
+
+def remove_spectator(sid):
+    game_code = spectators.pop(sid)
+    leave_room(spectator_room(game_code), sid=sid)
+    spectator_counts[game_code] -= 1
+    if spectator_counts[game_code] <= 0:
+        del spectator_counts[game_code]
+
+
+def spectator_question_frame(game_code, game):
+    frame = engine.question_payload(game_code, game['current_question'])
+    frame.update(type='question', start_time=game['server_start_time'], server_time=int(time.time() * 1000))
+    return json.dumps(frame, ensure_ascii=False)
+
+
+def spectator_snapshot(game_code, game):
     questions = game_manager.questions[game_code]
-    q_idx = game['current_question']
-    if q_idx >= len(questions): return
-    q = questions[q_idx]
-    game['question_active'] = True
-    game['answers'] = {}
-    game['question_start_time'] = time.time()
-    game['server_start_time'] = int(time.time() * 1000)
-    game['server_time_limit'] = q['time_limit']
-    game['results_shown'] = False
-    socketio.emit('message', {
-        'type': 'show_question',
-        'question': {
-            'text': q['text'],
-            'options': q['options'],
-            'correct_answer': q['correct_answer'],
-            'time_limit': q['time_limit'],
-            'question_number': q_idx + 1,
-            'total_questions': len(questions)
-        }
-    }, room=game_code)
-    answers_received = len(game['answers'])
-    total_players = len([p for p in game['players'] if p['connected']])
-    socketio.emit('message', {
-        'type': 'question_started',
-        'question_text': q['text'],
+    q_idx = min(game['current_question'], len(questions) - 1)
+    snapshot = {
+        'type': 'update',
+        'title': game['title'],
+        'status': game['status'],
         'question_number': q_idx + 1,
         'total_questions': len(questions),
-        'time_limit': q['time_limit'],
-        'start_time': game['server_start_time'],
-        'server_time': int(time.time() * 1000),
-        'answers_received': answers_received,
-        'total_players': total_players
-    }, room=game_code)
-    game_manager.question_timers[game_code] = socketio.start_background_task(
-        question_timer_with_auto_results, game_code, q['time_limit']
-    )
+        'question_active': game['question_active'],
+        'answers_received': len(game['answers']),
+        'total_players': sum(1 for p in game['players'] if p['connected']),
+        'leaderboard': [{'name': p['name'], 'score': p['score']} for p in heapq.nlargest(
+            app.config['SPECTATOR_TOP_K'], game['players'], key=lambda p: p['score'])]
+    }
+    if game['question_active']:
+        snapshot.update(start_time=game['server_start_time'], time_limit=game['server_time_limit'],
+                        server_time=int(time.time() * 1000))
+    elif game['status'] != 'waiting' and game['answers']:
+        # Распределение ответов показываем только после закрытия вопроса, чтобы экран не подсказывал
+        histogram = [0] * len(questions[q_idx]['options'])
+        for ans in game['answers'].values():
+            if 0 <= ans['answer'] < len(histogram):
+                histogram[ans['answer']] += 1
+        snapshot.update(histogram=histogram, correct_answer=questions[q_idx]['correct_answer'])
+    return snapshot
+
+
+def publish_spectator_question(game_code, game):
+    if game_code in spectator_counts:
+        socketio.emit('spectator', spectator_question_frame(game_code, game), room=spectator_room(game_code))
+
+
+def spectator_feed(game_code):
+    try:
+        while spectator_counts.get(game_code):
+            tick = app.config['SPECTATOR_TICK']
+            if load_monitor.level >= LoadMonitor.ELEVATED:
+                tick *= 2 ** load_monitor.level
+            socketio.sleep(tick)
+            game = game_manager.get_game(game_code)
+            if not game or not spectator_counts.get(game_code):
+                break
+            # Кадр кодируется один раз на тик и уходит всей комнате как готовая строка
+            frame = json.dumps(spectator_snapshot(game_code, game), ensure_ascii=False)
+            socketio.emit('spectator', frame, room=spectator_room(game_code))
+    finally:
+        spectator_feeds.discard(game_code)
+
+
+# ---------- Консоль учителя ----------
+# Одно соединение следит за несколькими играми: вместо полного потока каждой комнаты
+# раз в тик приходит общая сводка, подробности по игре — по запросу
+consoles = {}
+console_last = {}
+console_feed_running = False
+
+
+@socketio.on('host_subscribe')
+def handle_host_subscribe(data):
+    codes = data.get('game_codes') if isinstance(data, dict) else None
+    if not isinstance(codes, list):
+        emit('message', {'type': 'error', 'message': 'Нужен список кодов игр'})
+        return
+    codes = list(dict.fromkeys(str(c).upper().strip() for c in codes if c))
+    if len(codes) > app.config['CONSOLE_MAX_GAMES']:
+        emit('message', {'type': 'error', 'message': 'Слишком много игр в одной консоли'})
+        return
+    found = [c for c in codes if game_manager.get_game(c)]
+    if not found:
+        remove_console(request.sid)
+        emit('console', {'type': 'console_status', 'games': [], 'missing': codes})
+        return
+    consoles[request.sid] = found
+    console_last.pop(request.sid, None)
+    emit('console', {'type': 'console_status', 'games': [console_entry(c, game_manager.get_game(c)) for c in found],
+                     'missing': [c for c in codes if c not in found]})
+    ensure_console_feed()
 
 
-def question_timer_with_auto_results(game_code, time_limit):
+@socketio.on('console_detail')
+def handle_console_detail(data):
+    game_code = str(data.get('game_code', '')).upper().strip() if isinstance(data, dict) else ''
     game = game_manager.get_game(game_code)
-    if not game: return
-    start = time.time()
-    end = start + time_limit
-    server_start = game.get('server_start_time', int(time.time() * 1000))
-    while time.time() < end and game.get('question_active', True):
-        socketio.sleep(0.5)
-        if not game.get('question_active'):
-            break
-        socketio.emit('message', {
-            'type': 'server_time_update',
-            'server_time': int(time.time() * 1000),
-            'time_limit': time_limit,
-            'start_time': server_start
-        }, room=game_code)
-    if game.get('question_active'):
-        game['question_active'] = False
-        socketio.emit('message', {'type': 'question_ended'}, room=game_code)
-        socketio.emit('message', {'type': 'question_completed'}, room=game_code)
-        socketio.sleep(2)
-        calculate_and_send_results(game_code)
+    if game_code not in consoles.get(request.sid, ()) or not game:
+        emit('message', {'type': 'error', 'message': 'Игра не найдена в консоли'})
+        return
+    detail = spectator_snapshot(game_code, game)
+    detail.update(type='console_detail', game_code=game_code,
+                  players=[{'name': p['name'], 'score': p['score'], 'connected': p['connected'],
+                            'answered': p['name'] in game['answers']} for p in game['players']])
+    emit('console', detail)
 
 
-def calculate_and_send_results(game_code, is_manual=False):
-    game = game_manager.get_game(game_code)
-    if not game: return
-    questions = game_manager.questions[game_code]
-    q_idx = game['current_question']
-    if q_idx >= len(questions): return
-    q = questions[q_idx]
-    results = {
-        'question': q['text'],
-        'correct_answer': q['correct_answer'],
-        'answers': [],
-        'leaderboard': [],
-        'is_last_question': q_idx + 1 >= len(questions)
+def remove_console(sid):
+    consoles.pop(sid, None)
+    console_last.pop(sid, None)
+
+
+def console_phase(game):
+    if game['status'] != 'active':
+        return game['status']
+    return 'question' if game['question_active'] else 'results'
+
+
+def console_entry(game_code, game):
+    entry = {
+        'game_code': game_code,
+        'title': game['title'],
+        'phase': console_phase(game),
+        'question_number': min(game['current_question'] + 1, game['total_questions']),
+        'total_questions': game['total_questions'],
+        'answers_received': len(game['answers']),
+        'total_players': sum(1 for p in game['players'] if p['connected']),
+        'host_connected': game['host_connected']
     }
-    for player in game['players']:
-        ans = game['answers'].get(player['name'])
-        if ans:
-            is_correct = ans['answer'] == q['correct_answer']
-            points = 0
-            if is_correct and ans['answer'] >= 0:
-                base = 100
-                bonus = int((ans['time_left'] / q['time_limit']) * 500)
-                points = base + bonus
-                player['score'] += points
-            results['answers'].append({
-                'team': player['name'],
-                'answer': ans['answer'],
-                'answer_text': q['options'][ans['answer']] if 0 <= ans['answer'] < len(q['options']) else 'Нет ответа',
-                'correct': is_correct,
-                'points_earned': points,
-                'total_score': player['score'],
-                'time_left': ans['time_left']
-            })
-        else:
-            results['answers'].append({
-                'team': player['name'],
-                'answer': -1,
-                'answer_text': 'Нет ответа',
-                'correct': False,
-                'points_earned': 0,
-                'total_score': player['score'],
-                'time_left': 0
-            })
-    for p in game['players']:
-        results['leaderboard'].append({'name': p['name'], 'score': p['score']})
-    results['leaderboard'].sort(key=lambda x: x['score'], reverse=True)
-    final_results = [{'name': p['name'], 'score': p['score']} for p in game['players']]
-    final_results.sort(key=lambda x: x['score'], reverse=True)
-    socketio.emit('message', {
-        'type': 'show_results',
-        'results': results,
-        'final_results': final_results,
-        'is_last_question': results['is_last_question']
-    }, room=game_code)
-    if not results['is_last_question']:
-        for sec in range(7, 0, -1):
-            socketio.sleep(1)
-            socketio.emit('message', {'type': 'auto_next_countdown', 'seconds_left': sec}, room=game_code)
-        socketio.sleep(1)
-        game['current_question'] += 1
-        game['question_active'] = False
-        game['results_shown'] = True
-        show_question_to_all(game_code)
-    else:
-        game['status'] = 'finished'
-        game['question_active'] = False
-        socketio.sleep(5)
-        socketio.emit('message', {'type': 'game_over', 'final_results': final_results}, room=game_code)
-        socketio.sleep(10)
-        current_game = game_manager.get_game(game_code)
-        if current_game and current_game['status'] == 'finished':
-            game_manager.reset_game(game_code)
+    if game['question_active'] and game['question_start_mono'] is not None:
+        elapsed = time.monotonic() - game['question_start_mono']
+        entry['time_left'] = max(0, min(game['server_time_limit'], int(game['server_time_limit'] - elapsed)))
+    return entry
+
+
+def ensure_console_feed():
+    global console_feed_running
+    if not console_feed_running:
+        console_feed_running = True
+        socketio.start_background_task(console_feed)
+
+
+def console_feed():
+    # Один цикл на все консоли: статус каждой игры считается раз за тик,
+    # соединению уходит только изменившийся список
+    global console_feed_running
+    try:
+        while consoles:
+            tick = app.config['CONSOLE_TICK']
+            if load_monitor.level >= LoadMonitor.ELEVATED:
+                tick *= 2 ** load_monitor.level
+            socketio.sleep(tick)
+            entries = {}
+            for sid, codes in list(consoles.items()):
+                games = []
+                for code in codes:
+                    if code not in entries:
+                        game = game_manager.get_game(code)
+                        entries[code] = console_entry(code, game) if game else None
+                    if entries[code] is not None:
+                        games.append(entries[code])
+                if games == console_last.get(sid):
+                    continue
+                console_last[sid] = games
+                socketio.emit('console', {'type': 'console_status', 'games': games}, room=sid)
+    finally:
+        console_feed_running = False
+
+
+# ---------- Профилирование ----------
+active_profiler = None
+
+
+def socketio_handler_codes():
+    handlers = [h for _, h, _ in socketio.handlers]
+    if socketio.server:
+        for namespace_handlers in socketio.server.handlers.values():
+            handlers.extend(namespace_handlers.values())
+    return {inspect.unwrap(h).__code__ for h in handlers}
+
+
+PROFILE_FILTERS = {
+    'handlers': socketio_handler_codes,
+    'phases': lambda: {f.__code__ for f in (GameEngine.show_question_to_all,
+                                            GameEngine.question_timer_with_auto_results,
+                                            GameEngine.calculate_and_send_results)}
+}
+
+
+@app.route('/api/admin/profile')
+@admin_required
+def api_admin_profile():
+    global active_profiler
+    if active_profiler is not None:
+        return jsonify(success=False, message='Профилирование уже запущено'), 409
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.005))
+    except ValueError:
+        return jsonify(success=False, message='Некорректные параметры'), 400
+    # nan проходит через min/max, а socketio.sleep(nan) не вернётся никогда
+    if not math.isfinite(seconds) or not math.isfinite(interval):
+        return jsonify(success=False, message='Некорректные параметры'), 400
+    seconds = min(max(seconds, 0.1), app.config['PROFILE_MAX_SECONDS'])
+    interval = min(max(interval, 0.001), 1.0)
+    filter_codes = None
+    names = [n for n in request.args.get('filter', '').split(',') if n]
+    if names:
+        if any(n not in PROFILE_FILTERS for n in names):
+            return jsonify(success=False, message='Неизвестный фильтр'), 400
+        filter_codes = set()
+        for n in names:
+            filter_codes |= PROFILE_FILTERS[n]()
+    profiler = SamplingProfiler(interval=interval, filter_codes=filter_codes)
+    active_profiler = profiler
+    try:
+        profiler.start()
+        socketio.sleep(seconds)
+    finally:
+        profiler.stop()
+        active_profiler = None
+    filename = 'profile-%s.collapsed' % datetime.now().strftime('%Y%m%d-%H%M%S')
+    return Response(profiler.collapsed(), mimetype='text/plain', headers={
+        'Content-Disposition': 'attachment; filename=%s' % filename,
+        'X-Profile-Samples': str(profiler.total)
+    })
+
+
+# ---------- Память ----------
+allocation_tracker = AllocationTracker()
+
+
+@app.route('/api/admin/memory')
+@admin_required
+def api_admin_memory():
+    # ?tracemalloc=start[&frames=N] — начать трассировку и взять базовый снимок,
+    # ?tracemalloc=diff — что выросло с прошлого снимка, ?tracemalloc=stop — выключить
+    try:
+        limit = max(0, int(request.args.get('games', 50)))
+        top = max(1, int(request.args.get('top', 25)))
+        frames = min(max(1, int(request.args.get('frames', 1))), 25)
+    except ValueError:
+        return jsonify(success=False, message='Некорректные параметры'), 400
+    action = request.args.get('tracemalloc')
+    growth = None
+    if action == 'start':
+        allocation_tracker.start(frames)
+    elif action == 'stop':
+        allocation_tracker.stop()
+    elif action == 'diff':
+        growth = allocation_tracker.diff(top)
+        if growth is None:
+            return jsonify(success=False, message='Сначала запустите tracemalloc=start'), 409
+    elif action is not None:
+        return jsonify(success=False, message='Неизвестное действие'), 400
+    sockets = {'spectators': spectators, 'consoles': consoles}
+    return jsonify(
+        success=True,
+        rss_kb=process_rss_kb(),
+        games_total=len(game_manager.games),
+        structures=structure_sizes(engine, dict(sockets, spectator_counts=spectator_counts,
+                                                spectator_feeds=spectator_feeds, console_last=console_last)),
+        games=game_sizes(engine, limit),
+        orphans=find_orphans(engine, lambda sid: socketio.server.manager.is_connected(sid, '/'),
+                             lambda greenlet: not greenlet.dead, sockets),
+        tracemalloc=dict(allocation_tracker.status(), growth=growth)
+    )
+
+
+# ---------- Запуск ----------
+def game_code_allocator():
+    # Распределители воркеров независимы, поэтому при нескольких воркерах за префиксом шарда
+    # идёт символ воркера: коды разных воркеров не пересекаются, а длина кода не меняется
+    length, shard = app.config['GAME_CODE_LENGTH'], app.config['GAME_CODE_SHARD']
+    slot = app.config['GAME_CODE_WORKER']
+    if slot is None:
+        return GameCodeAllocator(length, shard)
+    if slot >= len(ALPHABET):
+        raise ValueError('Не больше %d воркеров на один префикс шарда' % len(ALPHABET))
+    return GameCodeAllocator(length - 1, shard + ALPHABET[slot])
+
+
+def render_index_page():
+    length = app.config['GAME_CODE_LENGTH']
+    shard = app.config['GAME_CODE_SHARD'].upper()
+    with app.app_context():
+        body = render_template_string(HTML_TEMPLATE, code_length=len(shard) + length,
+                                      code_example=shard + ('K7M2QX' * length)[:length]).encode('utf-8')
+    return {
+        'body': body,
+        'gzip': gzip.compress(body, 9),
+        'etag': hashlib.sha1(body).hexdigest()[:16]
+    }
+
+
+def init_storage(config=None):
+    # Общая часть для обоих бэкендов: конфигурация, хранилища, страница и прогретый кэш
+    global quiz_library, results_archive, season_leaderboard, media_store, index_page
+    if config:
+        app.config.update(config)
+    database = app.config['DATABASE']
+    for store in (quiz_library, results_archive, season_leaderboard):
+        if store is not None:
+            store.close()
+    quiz_library = QuizLibrary(database, app.config['QUIZ_CACHE_SIZE'])
+    results_archive = ResultsArchive(database)
+    season_leaderboard = SeasonLeaderboard(database)
+    media_store = MediaStore(app.config['MEDIA_ROOT'], app.config['MEDIA_MAX_SIZE'])
+    engine.archive = results_archive
+    engine.leaderboard = season_leaderboard
+    engine.codes = game_code_allocator()
+    index_page = render_index_page()
+    quiz_library.warm(app.config['QUIZ_CACHE_WARM'])
+
+
+def create_app(config=None):
+    global traffic_recorder
+    init_storage(config)
+    if socketio.server is None:
+        socketio.init_app(app)
+        if app.config['TRAFFIC_RECORD']:
+            traffic_recorder = TrafficRecorder(app.config['TRAFFIC_RECORD'])
+            traffic_recorder.install(socketio.server)
+            atexit.register(traffic_recorder.close)
+    return app
+
+
+def before_fork():
+    # Вызывается в мастере gunicorn: данные уже прогреты, соединения SQLite закрываем,
+    # а всё живое переводим в постоянное поколение GC, чтобы сборщик в воркерах
+    # не трогал эти страницы и они оставались общими (copy-on-write).
+    # Без preload_app хранилищ в мастере нет — воркер создаст их сам
+    if quiz_library is None:
+        return
+    for store in (quiz_library, results_archive, season_leaderboard):
+        store.close()
+    gc.collect()
+    gc.freeze()
+
+
+def after_fork(worker_slot=None):
+    # Без preload_app приложение загрузится в воркере позже и возьмёт номер из конфигурации
+    app.config['GAME_CODE_WORKER'] = worker_slot
+    if quiz_library is None:
+        return
+    for store in (quiz_library, results_archive, season_leaderboard):
+        store.connect()
+    # Распределитель из мастера скопирован во все воркеры с одними параметрами и счётчиком —
+    # иначе они выдавали бы одинаковые коды
+    engine.codes = game_code_allocator()
 
 
 if __name__ == '__main__':
     print("Запуск платформы для викторин на Flask...")
     print("Сервер доступен по адресу http://localhost:5000")
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000, allow_unsafe_werkzeug=True)
+    socketio.run(create_app(), debug=True, host='0.0.0.0', port=5000, allow_unsafe_werkzeug=True)
 
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import os
+import re
+from urllib.parse import parse_qs
+
+import socketio
+
+import Bro_helper
+from game_engine import STATUS_FIELDS, GameEngine, GameManager, Outbox
+from media_store import MediaFile, media_range
+from traffic_recorder import TrafficRecorder, should_capture_body, should_record
+
+# Второй режим: то же ядро игры на asyncio под ASGI-сервером
+#   uvicorn --factory asgi_app:create_asgi_app --host 0.0.0.0 --port 5000
+# Здесь обслуживается всё, что нужно для живой игры: страница, создание игры и вход команды,
+# статус, медиа и протокол сокета. Библиотека, импорт, выгрузка, сезон, зрители и консоль
+# остаются на gevent-бэкенде.
+
+MAX_BODY = 1024 * 1024
+STATUS_PATH = re.compile(r'^/api/game/([^/]+)/status$')
+MEDIA_PATH = re.compile(r'^/media/([^/]+)$')
+
+config = Bro_helper.app.config
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+traffic_recorder = None
+
+
+class AsyncioTransport:
+    # Транспорт ядра игры поверх python-socketio AsyncServer
+    def __init__(self):
+        self.tasks = set()
+        self.outbox = Outbox(lambda room: self.start(self.flush(room)))
+
+    def start(self, coro):
+        # asyncio держит на задачи только слабые ссылки, поэтому храним их до завершения
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def flush(self, room):
+        payload = self.outbox.take(room)
+        if payload is not None:
+            await sio.emit('message', payload, room=room)
+
+    def send(self, payload, room):
+        self.outbox.put(payload, room)
+
+    send_optional = send
+
+    def join(self, sid, room):
+        sio.manager.basic_enter_room(sid, '/', room)
+
+    def leave(self, sid, room):
+        sio.manager.basic_leave_room(sid, '/', room)
+
+    def spawn(self, phase):
+        return self.start(self.run_phase(phase))
+
+    @staticmethod
+    async def run_phase(phase):
+        for delay in phase:
+            await asyncio.sleep(delay)
+
+    def question_revealed(self, game_code, game):
+        pass
+
+
+game_manager = GameManager(asyncio.Event)
+engine = GameEngine(game_manager, config, AsyncioTransport())
+
+
+@sio.on('teacher_join')
+async def handle_teacher_join(sid, data):
+    engine.teacher_join(sid, data)
+
+
+@sio.on('player_join')
+async def handle_player_join(sid, data):
+    engine.player_join(sid, data)
+
+
+@sio.on('request_question')
+async def handle_request_question(sid, data=None):
+    engine.request_question(sid)
+
+
+@sio.on('host_message')
+async def handle_host_message(sid, data):
+    engine.host_message(sid, data)
+
+
+@sio.on('submit_answer')
+async def handle_submit_answer(sid, data):
+    engine.submit_answer(sid, data)
+
+
+@sio.on('relay_join')
+async def handle_relay_join(sid, data):
+    engine.relay_join(sid, data)
+
+
+@sio.on('relay_event')
+async def handle_relay_event(sid, data):
+    engine.relay_event(sid, data)
+
+
+@sio.on('relay_answers')
+async def handle_relay_answers(sid, data):
+    engine.relay_answers(sid, data)
+
+
+@sio.on('disconnect')
+async def handle_disconnect(sid, *args):
+    engine.disconnect(sid)
+
+
+# ---------- HTTP ----------
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY:
+            return None
+        if not message.get('more_body'):
+            return body
+
+
+def parse_json(body):
+    if body is None:
+        return None
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def respond(send, status, body, content_type='application/json', headers=()):
+    if isinstance(body, dict):
+        body = json.dumps(body).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('ascii')),
+                    (b'content-length', str(len(body)).encode('ascii'))]
+                   + [(k.encode('ascii'), v.encode('latin-1')) for k, v in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def index(request_headers, send):
+    page = Bro_helper.index_page
+    etag = '"%s"' % page['etag']
+    headers = [('etag', etag), ('vary', 'Accept-Encoding')]
+    if etag in request_headers.get('if-none-match', ''):
+        await respond(send, 304, b'', 'text/html', headers)
+    elif 'gzip' in request_headers.get('accept-encoding', ''):
+        await respond(send, 200, page['gzip'], 'text/html; charset=utf-8', headers + [('content-encoding', 'gzip')])
+    else:
+        await respond(send, 200, page['body'], 'text/html; charset=utf-8', headers)
+
+
+async def game_status(game_code, query, request_headers, send):
+    game_code = game_code.upper()
+    game = game_manager.get_game(game_code)
+    if not game:
+        return await respond(send, 404, {'success': False, 'message': 'Игра не найдена'})
+    fields = [f for f in query.get('fields', [''])[0].split(',') if f] or list(STATUS_FIELDS)
+    if any(f not in STATUS_FIELDS for f in fields):
+        return await respond(send, 400, {'success': False, 'message': 'Неизвестное поле'})
+    try:
+        since = int(query['since'][0]) if 'since' in query else None
+        timeout = float(query.get('timeout', ['25'])[0])
+    except ValueError:
+        return await respond(send, 400, {'success': False, 'message': 'Некорректные параметры'})
+    if since is not None:
+        event = game_manager.change_event(game_code, since)
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), max(0, min(timeout, config['STATUS_LONG_POLL_MAX'])))
+            except asyncio.TimeoutError:
+                pass
+        game = game_manager.get_game(game_code)
+        if not game:
+            return await respond(send, 404, {'success': False, 'message': 'Игра не найдена'})
+    version, etag, body = engine.status_body(game_code, game, fields)
+    headers = [('etag', '"%s"' % etag), ('x-game-version', str(version))]
+    if '"%s"' % etag in request_headers.get('if-none-match', ''):
+        return await respond(send, 304, b'', headers=headers)
+    await respond(send, 200, body, headers=headers)
+
+
+async def serve_media(name, request_headers, send):
+    path = Bro_helper.media_store.path(name)
+    if path is None:
+        return await respond(send, 404, {'success': False, 'message': 'Файл не найден'})
+    etag = '"%s"' % name.split('.')[0]
+    headers = [('etag', etag), ('accept-ranges', 'bytes'), ('cache-control', 'public, max-age=31536000, immutable')]
+    if etag in request_headers.get('if-none-match', ''):
+        return await respond(send, 304, b'', headers=headers)
+    size = os.path.getsize(path)
+    status, offset, length = media_range(request_headers.get('range'), request_headers.get('if-range'), etag, size)
+    if status == 416:
+        return await respond(send, 416, b'', headers=headers + [('content-range', 'bytes */%d' % size)])
+    if status == 206:
+        headers.append(('content-range', 'bytes %d-%d/%d' % (offset, offset + length - 1, size)))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', Bro_helper.EXTENSION_TYPES[name.rsplit('.', 1)[1]].encode('ascii')),
+                    (b'content-length', str(length).encode('ascii'))]
+                   + [(k.encode('ascii'), v.encode('latin-1')) for k, v in headers]
+    })
+    # Файл читается кусками в пуле потоков, чтобы диск не останавливал цикл событий
+    media = MediaFile(path, offset, length)
+    chunks = iter(media)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        await loop.run_in_executor(None, media.close)
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def http_app(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    path, method = scope['path'], scope['method']
+    request_headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope['headers']}
+    raw = await read_body(receive) if method == 'POST' else b''
+    if traffic_recorder is not None and should_record(path):
+        body = raw if raw and should_capture_body(path, len(raw)) else None
+        traffic_recorder.http_call(method, path, scope['query_string'].decode('latin-1'), body, len(raw or b''))
+    if path == '/' and method == 'GET':
+        return await index(request_headers, send)
+    if path == '/api/create_game' and method == 'POST':
+        data = parse_json(raw)
+        if data is None:
+            return await respond(send, 400, {'success': False, 'message': 'Некорректный запрос'})
+        body, status = engine.create_game(data, Bro_helper.quiz_library)
+        if traffic_recorder is not None and status == 200:
+            traffic_recorder.game_created(body['game_code'])
+        return await respond(send, status, body)
+    if path == '/api/join_game' and method == 'POST':
+        data = parse_json(raw) or {}
+        game_code = str(data.get('game_code', '')).upper().strip()
+        team_name = str(data.get('team_name', '')).strip()
+        if not game_code or not team_name:
+            return await respond(send, 400, {'success': False, 'message': 'Не хватает данных'})
+        body, status = engine.join_game(game_code, team_name)
+        return await respond(send, status, body)
+    match = STATUS_PATH.match(path)
+    if match and method == 'GET':
+        query = parse_qs(scope['query_string'].decode('latin-1'))
+        return await game_status(match.group(1), query, request_headers, send)
+    match = MEDIA_PATH.match(path)
+    if match and method == 'GET':
+        return await serve_media(match.group(1), request_headers, send)
+    await respond(send, 404, {'success': False, 'message': 'Не найдено'})
+
+
+def create_asgi_app(config=None):
+    global traffic_recorder
+    Bro_helper.init_storage(config)
+    engine.archive = Bro_helper.results_archive
+    engine.leaderboard = Bro_helper.season_leaderboard
+    settings = Bro_helper.app.config
+    engine.codes = Bro_helper.game_code_allocator()
+    path = settings['TRAFFIC_RECORD']
+    if path and traffic_recorder is None:
+        traffic_recorder = TrafficRecorder(path)
+        traffic_recorder.install(sio)
+        # uvicorn завершает процесс повторным сигналом, atexit не сработает — закрываем файл при остановке
+        return socketio.ASGIApp(sio, other_asgi_app=http_app, on_shutdown=traffic_recorder.close)
+    return socketio.ASGIApp(sio, other_asgi_app=http_app)
@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import websockets
+
+ROOT = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+WANTED = ('"reveal_question"', '"show_question"', '"answer_received"')
+
+# Сравнение gevent- и asyncio-бэкендов на одном воркере:
+#   сколько соединений воркер принимает, задержка подтверждения ответа (submit_answer ->
+#   answer_received) и прирост памяти воркера на одно соединение.
+# Клиенты — сырой Engine.IO v4 поверх websockets, чтобы тысячи соединений держал один процесс.
+#   python benchmarks/backends.py --clients 200 1000
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def post(url, data):
+    request = urllib.request.Request(url, json.dumps(data).encode('utf-8'), {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=10) as r:
+        return json.loads(r.read())
+
+
+def rss_kb(pid):
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def start_server(backend, port, tmp, root=ROOT, speed=1):
+    env = dict(os.environ, QUIZ_DATABASE=os.path.join(tmp, 'quiz.db'), QUIZ_MEDIA_ROOT=os.path.join(tmp, 'media'),
+               QUIZ_GAME_SPEED=str(speed))
+    env.pop('QUIZ_RECORD', None)
+    if backend == 'gevent':
+        env.update(QUIZ_BIND='127.0.0.1:%d' % port, WEB_CONCURRENCY='1')
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(root, 'gunicorn.conf.py')]
+    else:
+        cmd = [sys.executable, '-m', 'uvicorn', '--factory', 'asgi_app:create_asgi_app', '--host', '127.0.0.1',
+               '--port', str(port), '--ws', 'websockets-sansio', '--ws-per-message-deflate', 'false',
+               '--log-level', 'warning', '--no-access-log']
+    proc = subprocess.Popen(cmd, cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen('http://127.0.0.1:%d/' % port, timeout=1).read()
+            break
+        except OSError:
+            time.sleep(0.1)
+    worker = proc.pid
+    if backend == 'gevent':
+        with open('/proc/%d/task/%d/children' % (proc.pid, proc.pid)) as f:
+            worker = int(f.read().split()[0])
+    return proc, worker
+
+
+class Client:
+    wanted = WANTED
+
+    def __init__(self, url, game_code, name, host=False):
+        self.url = url
+        self.game_code = game_code
+        self.name = name
+        self.host = host
+        self.sent_at = None
+        self.latency = None
+        self.ws = None
+
+    async def connect(self):
+        self.ws = await websockets.connect(self.url, max_size=None, ping_interval=None, open_timeout=30,
+                                           compression=None)
+        await self.ws.recv()
+        await self.ws.send('40')
+        while not (await self.ws.recv()).startswith('40'):
+            pass
+        if self.host:
+            await self.emit('teacher_join', {'game_code': self.game_code})
+        else:
+            await self.emit('player_join', {'game_code': self.game_code, 'player_name': self.name})
+
+    async def emit(self, event, data):
+        await self.ws.send('42' + json.dumps([event, data]))
+
+    async def run(self):
+        try:
+            async for frame in self.ws:
+                if frame == '2':
+                    await self.ws.send('3')
+                    continue
+                # Списки команд приходят большими кадрами — разбираем только нужные типы
+                if not frame.startswith('42') or not any(t in frame for t in self.wanted):
+                    continue
+                event, payload = json.loads(frame[2:])
+                if event != 'message':
+                    continue
+                for message in payload['messages'] if payload['type'] == 'batch' else [payload]:
+                    await self.handle(message)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def handle(self, message):
+        if self.host:
+            return
+        if message['type'] in ('reveal_question', 'show_question') and self.sent_at is None:
+            self.sent_at = time.perf_counter()
+            await self.emit('submit_answer', {'game_code': self.game_code, 'answer': 0})
+        elif message['type'] == 'answer_received' and self.latency is None:
+            self.latency = time.perf_counter() - self.sent_at
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float('nan')
+
+
+async def run_round(port, worker, clients_count, concurrency):
+    base = 'http://127.0.0.1:%d' % port
+    loop = asyncio.get_running_loop()
+    game_code = (await loop.run_in_executor(None, post, base + '/api/create_game', {
+        'title': 'Нагрузка',
+        'questions': [{'text': 'Сколько?', 'options': ['1', '2', '3', '4'], 'correct_answer': 0, 'time_limit': 30}]
+    }))['game_code']
+    names = ['team-%d' % i for i in range(clients_count)]
+    await asyncio.gather(*(loop.run_in_executor(None, post, base + '/api/join_game',
+                                                {'game_code': game_code, 'team_name': n}) for n in names))
+    url = 'ws://127.0.0.1:%d/socket.io/?EIO=4&transport=websocket' % port
+    host = Client(url, game_code, None, host=True)
+    await host.connect()
+    # Читатели стартуют сразу после рукопожатия: иначе сервер закроет молчащие на ping соединения
+    readers = [asyncio.create_task(host.run())]
+    rss_before = rss_kb(worker)
+    gate = asyncio.Semaphore(concurrency)
+    players = [Client(url, game_code, n) for n in names]
+
+    async def connect(client):
+        async with gate:
+            try:
+                await client.connect()
+                readers.append(asyncio.create_task(client.run()))
+                return True
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+                return False
+
+    started = time.perf_counter()
+    connected = await asyncio.gather(*(connect(c) for c in players))
+    connect_time = time.perf_counter() - started
+    players = [c for c, ok in zip(players, connected) if ok]
+    await asyncio.sleep(1)
+    rss_after = rss_kb(worker)
+    await host.emit('host_message', {'type': 'start_game', 'game_code': game_code})
+    deadline = time.time() + 30
+    while time.time() < deadline and any(c.latency is None for c in players):
+        await asyncio.sleep(0.2)
+    latencies = [c.latency * 1000 for c in players if c.latency is not None]
+    for c in players + [host]:
+        await c.ws.close()
+    for task in readers:
+        task.cancel()
+    return {
+        'connected': len(players),
+        'connect_time': connect_time,
+        'kb_per_connection': (rss_after - rss_before) / max(1, len(players)),
+        'acked': len(latencies),
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': max(latencies) if latencies else float('nan')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gevent против asyncio на одном воркере')
+    parser.add_argument('--clients', type=int, nargs='+', default=[200, 1000])
+    parser.add_argument('--backends', nargs='+', default=['gevent', 'asyncio'], choices=['gevent', 'asyncio'])
+    parser.add_argument('--concurrency', type=int, default=100, help='одновременных рукопожатий')
+    args = parser.parse_args()
+    for clients_count in args.clients:
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory() as tmp:
+                port = free_port()
+                proc, worker = start_server(backend, port, tmp)
+                try:
+                    r = asyncio.run(run_round(port, worker, clients_count, args.concurrency))
+                finally:
+                    proc.send_signal(signal.SIGTERM)
+                    proc.wait(30)
+            print('%-7s клиентов %5d: подключено %5d за %.2f с, %.1f КБ на соединение; '
+                  'ACK %d, p50 %.1f мс, p95 %.1f мс, p99 %.1f мс, max %.1f мс' % (
+                      backend, clients_count, r['connected'], r['connect_time'], r['kb_per_connection'],
+                      r['acked'], r['p50'], r['p95'], r['p99'], r['max']))
+
+
+if __name__ == '__main__':
+    main()
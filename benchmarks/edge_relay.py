@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+
+from backends import ROOT, Client, free_port, percentile, post, start_server
+
+# Трафик по школьному каналу с классным ретранслятором и без него.
+# Сервер, ретранслятор и клиенты — отдельные локальные процессы; «канал» — счётчик байт
+# на TCP-прокси перед сервером. Учитель подключается к серверу мимо канала.
+#   python benchmarks/edge_relay.py --clients 30 --questions 3
+
+
+class Uplink:
+    # TCP-прокси, считающий байты в обе стороны
+    def __init__(self, target_port):
+        self.target_port = target_port
+        self.up = 0
+        self.down = 0
+
+    async def pipe(self, reader, writer, direction):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                if direction == 'up':
+                    self.up += len(data)
+                else:
+                    self.down += len(data)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, reader, writer):
+        try:
+            server_reader, server_writer = await asyncio.open_connection('127.0.0.1', self.target_port)
+        except OSError:
+            writer.close()
+            return
+        try:
+            await asyncio.gather(self.pipe(reader, server_writer, 'up'), self.pipe(server_reader, writer, 'down'))
+        except asyncio.CancelledError:
+            pass
+
+    async def start(self, port):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', port)
+
+
+class Player(Client):
+    # Отвечает на каждый вопрос и меряет время до подтверждения
+    def __init__(self, url, game_code, name):
+        super().__init__(url, game_code, name)
+        self.latencies = []
+
+    async def handle(self, message):
+        if message['type'] in ('reveal_question', 'show_question'):
+            self.sent_at = time.perf_counter()
+            await self.emit('submit_answer', {'game_code': self.game_code, 'answer': 0})
+        elif message['type'] == 'answer_received' and self.sent_at is not None:
+            self.latencies.append(time.perf_counter() - self.sent_at)
+            self.sent_at = None
+
+
+class Host(Client):
+    # Закрывает вопрос, как только ответили все, и ждёт итогов последнего
+    wanted = ('"question_started"', '"question_stats_update"', '"show_results"')
+
+    def __init__(self, url, game_code, players_count):
+        super().__init__(url, game_code, None, host=True)
+        self.players_count = players_count
+        self.question_open = False
+        self.finished = asyncio.Event()
+
+    async def handle(self, message):
+        if message['type'] == 'question_started':
+            self.question_open = True
+        elif message['type'] == 'question_stats_update' and self.question_open \
+                and message['answers_received'] >= self.players_count:
+            self.question_open = False
+            await self.emit('host_message', {'type': 'end_question_early', 'game_code': self.game_code})
+        elif message['type'] == 'show_results' and message['is_last_question']:
+            self.finished.set()
+
+
+def start_relay(port, upstream_port):
+    cmd = [sys.executable, os.path.join(ROOT, 'edge_relay.py'), '--upstream', 'http://127.0.0.1:%d' % upstream_port,
+           '--host', '127.0.0.1', '--port', str(port)]
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen('http://127.0.0.1:%d/' % port, timeout=1).read()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return proc
+
+
+async def run_round(mode, server_port, clients_count, questions):
+    uplink = Uplink(server_port)
+    uplink_port = free_port()
+    await uplink.start(uplink_port)
+    relay = None
+    edge_port = uplink_port
+    if mode == 'relay':
+        edge_port = free_port()
+        relay = await asyncio.get_running_loop().run_in_executor(None, start_relay, edge_port, uplink_port)
+    try:
+        return await play(uplink, server_port, edge_port, clients_count, questions)
+    finally:
+        uplink.server.close()
+        if relay is not None:
+            relay.send_signal(signal.SIGTERM)
+            relay.wait(30)
+
+
+async def play(uplink, server_port, edge_port, clients_count, questions):
+    loop = asyncio.get_running_loop()
+    game_code = (await loop.run_in_executor(None, post, 'http://127.0.0.1:%d/api/create_game' % server_port, {
+        'title': 'Класс',
+        'questions': [{'text': 'Вопрос %d' % i, 'options': ['1', '2', '3', '4'], 'correct_answer': 0,
+                       'time_limit': 10} for i in range(questions)]
+    }))['game_code']
+    edge = 'http://127.0.0.1:%d' % edge_port
+    names = ['team-%d' % i for i in range(clients_count)]
+    up, down = uplink.up, uplink.down
+    for name in names:
+        await loop.run_in_executor(None, post, edge + '/api/join_game', {'game_code': game_code, 'team_name': name})
+    host = Host('ws://127.0.0.1:%d/socket.io/?EIO=4&transport=websocket' % server_port, game_code, clients_count)
+    await host.connect()
+    readers = [asyncio.create_task(host.run())]
+    url = 'ws://127.0.0.1:%d/socket.io/?EIO=4&transport=websocket' % edge_port
+    players = [Player(url, game_code, name) for name in names]
+    for player in players:
+        await player.connect()
+        readers.append(asyncio.create_task(player.run()))
+    await asyncio.sleep(1)
+    await host.emit('host_message', {'type': 'start_game', 'game_code': game_code})
+    try:
+        await asyncio.wait_for(host.finished.wait(), questions * 30)
+    except asyncio.TimeoutError:
+        pass
+    latencies = [x * 1000 for p in players for x in p.latencies]
+    result = {
+        'up': uplink.up - up,
+        'down': uplink.down - down,
+        'acked': len(latencies),
+        'expected': clients_count * questions,
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95)
+    }
+    for client in players + [host]:
+        await client.ws.close()
+    for task in readers:
+        task.cancel()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Трафик школьного канала с ретранслятором и без')
+    parser.add_argument('--clients', type=int, default=30)
+    parser.add_argument('--questions', type=int, default=3)
+    args = parser.parse_args()
+    # Сервер и ретранслятор получают общий секрет через окружение
+    os.environ['QUIZ_RELAY_TOKEN'] = uuid.uuid4().hex
+    with tempfile.TemporaryDirectory() as tmp:
+        server_port = free_port()
+        server, _ = start_server('gevent', server_port, tmp)
+        try:
+            for mode in ('direct', 'relay'):
+                r = asyncio.run(run_round(mode, server_port, args.clients, args.questions))
+                print('%-6s: канал к серверу %.1f КБ, от сервера %.1f КБ; подтверждено %d из %d, '
+                      'p50 %.1f мс, p95 %.1f мс' % (mode, r['up'] / 1024, r['down'] / 1024, r['acked'],
+                                                    r['expected'], r['p50'], r['p95']))
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(30)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from game_codes import GameCodeAllocator
+
+# Выдача кодов игр при миллионе живых кодов: новый распределитель против прежнего
+# «uuid4()[:6] и повтор при совпадении».
+#   python benchmarks/game_codes.py --codes 1000000
+
+
+def uuid_codes(live, count):
+    # Прежний способ: 6 hex-символов, повтор, пока код занят
+    attempts = 0
+    started = time.perf_counter()
+    for _ in range(count):
+        code = str(uuid.uuid4())[:6].upper()
+        attempts += 1
+        while code in live:
+            code = str(uuid.uuid4())[:6].upper()
+            attempts += 1
+        live.add(code)
+    return time.perf_counter() - started, attempts
+
+
+def fill(allocator, count):
+    live = set()
+    started = time.perf_counter()
+    for _ in range(count):
+        live.add(allocator.allocate())
+    return time.perf_counter() - started, live
+
+
+def churn(allocator, live, count):
+    # Выселяем случайную игру и сразу создаём новую
+    pool = list(live)
+    started = time.perf_counter()
+    for _ in range(count):
+        i = random.randrange(len(pool))
+        allocator.release(pool[i])
+        live.discard(pool[i])
+        code = allocator.allocate()
+        assert code not in live
+        live.add(code)
+        pool[i] = code
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Выдача кодов игр при большом числе живых игр')
+    parser.add_argument('--codes', type=int, default=1000000)
+    parser.add_argument('--churn', type=int, default=200000)
+    args = parser.parse_args()
+
+    allocator = GameCodeAllocator(6)
+    elapsed, live = fill(allocator, args.codes)
+    assert len(live) == args.codes
+    print('распределитель, 6 символов: %d кодов за %.2f с, %.2f мкс на код, все уникальны' % (
+        args.codes, elapsed, elapsed / args.codes * 1e6))
+
+    # 4 символа — 1 048 576 кодов: счётчик исчерпан, дальше работает только очередь освобождённых
+    allocator = GameCodeAllocator(4)
+    elapsed, live = fill(allocator, allocator.size)
+    for code in random.sample(sorted(live), allocator.size - args.codes):
+        allocator.release(code)
+        live.discard(code)
+    elapsed = churn(allocator, live, args.churn)
+    print('распределитель, 4 символа, %d живых из %d: выселение + выдача %.2f мкс, свободно %d' % (
+        len(live), allocator.size, elapsed / args.churn * 1e6, allocator.available()))
+
+    live = set()
+    uuid_codes(live, args.codes - args.churn)
+    elapsed, attempts = uuid_codes(live, args.churn)
+    print('uuid4()[:6]: следующие %d кодов при %d живых — %.2f мкс на код, %.3f попытки в среднем' % (
+        args.churn, args.codes - args.churn, elapsed / args.churn * 1e6, attempts / args.churn))
+    space = 16 ** 6
+    for share in (0.5, 0.9, 0.99):
+        print('  при заполнении %d%% пространства hex-кодов ожидается %.0f попыток на код' % (
+            share * 100, 1 / (1 - share)))
+    print('  всего hex-кодов %d, кодов распределителя %d' % (space, 32 ** 6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import collections
+import gzip
+import json
+import os
+import signal
+import tempfile
+import time
+
+import aiohttp
+import websockets
+
+from backends import ROOT, free_port, percentile, rss_kb, start_server
+
+# Воспроизведение записи трафика (QUIZ_RECORD=traffic.jsonl.gz) на локальном сервере
+# и сравнение двух сборок по задержкам и CPU воркера:
+#   git worktree add /tmp/old HEAD~3
+#   python benchmarks/replay.py traffic.jsonl.gz --builds /tmp/old . --speed 4
+# Каждая сборка получает тот же поток событий с теми же паузами, делёнными на --speed.
+# Сервер запускается с QUIZ_GAME_SPEED=--speed: отсчёт, время на вопрос и паузы между вопросами
+# ускоряются так же, и ответы попадают в открытый вопрос. Сборки, которые не знают
+# QUIZ_GAME_SPEED, при --speed > 1 отклонят ответы как пришедшие до показа вопроса.
+
+# Событие сокета и тип сообщения, которым сервер на него отвечает
+REPLIES = {'connected': 'teacher_join', 'player_info': 'player_join', 'answer_received': 'submit_answer'}
+WANTED = tuple('"%s"' % t for t in REPLIES) + ('"error"', '"show_results"')
+
+
+def load_recording(path):
+    records = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+        except (EOFError, ValueError):
+            # Процесс остановили без закрытия файла — берём всё, что успело сброситься
+            pass
+    return records[1:]
+
+
+def cpu_seconds(pid):
+    with open('/proc/%d/stat' % pid) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class Connection:
+    # Одно записанное соединение: события уходят строго по порядку, ответы меряются
+    def __init__(self, replay):
+        self.replay = replay
+        self.queue = asyncio.Queue()
+        self.pending = {}
+        self.team = None
+        self.ws = None
+        self.task = replay.start(self.run())
+
+    async def run(self):
+        try:
+            self.ws = await websockets.connect(self.replay.ws_url, max_size=None, ping_interval=None,
+                                               open_timeout=30, compression=None)
+            await self.ws.recv()
+            await self.ws.send('40')
+            while not (await self.ws.recv()).startswith('40'):
+                pass
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+            self.replay.failures += 1
+            return
+        reader = self.replay.start(self.read())
+        while True:
+            event, data = await self.queue.get()
+            if event == 'disconnect':
+                break
+            self.pending[event] = time.perf_counter()
+            if event == 'player_join' and isinstance(data, dict):
+                self.team = data.get('player_name')
+            try:
+                await self.ws.send('42' + json.dumps([event, data] if data is not None else [event]))
+            except websockets.ConnectionClosed:
+                break
+        await self.ws.close()
+        reader.cancel()
+
+    async def read(self):
+        try:
+            async for frame in self.ws:
+                if frame == '2':
+                    await self.ws.send('3')
+                    continue
+                if not frame.startswith('42') or not any(t in frame for t in WANTED):
+                    continue
+                event, payload = json.loads(frame[2:])
+                if event != 'message':
+                    continue
+                for message in payload['messages'] if payload['type'] == 'batch' else [payload]:
+                    self.handle(message)
+        except websockets.ConnectionClosed:
+            pass
+
+    def handle(self, message):
+        if message['type'] == 'error':
+            self.replay.errors[message.get('message', '')] += 1
+            return
+        if message['type'] == 'show_results':
+            # Итоги вопроса видят все; считаем только строку своей команды — ответ, дошедший до подсчёта очков
+            for answer in message['results']['answers']:
+                if answer['team'] == self.team and answer['answer'] >= 0:
+                    self.replay.scored += 1
+            return
+        event = REPLIES.get(message['type'])
+        sent = self.pending.pop(event, None)
+        if sent is not None:
+            self.replay.latencies['socket ' + event].append((time.perf_counter() - sent) * 1000)
+
+
+class Replay:
+    def __init__(self, port, speed):
+        self.base = 'http://127.0.0.1:%d' % port
+        self.ws_url = 'ws://127.0.0.1:%d/socket.io/?EIO=4&transport=websocket' % port
+        self.speed = speed
+        self.codes = {}
+        self.created = collections.deque()
+        self.connections = {}
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.scored = 0
+        self.failures = 0
+        self.tasks = set()
+        self.session = None
+
+    def start(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def translate(self, value):
+        # Коды игр в записи заменяем на коды, выданные этой сборкой
+        if isinstance(value, str):
+            return self.codes.get(value, value)
+        if isinstance(value, dict):
+            return {k: self.translate(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.translate(v) for v in value]
+        return value
+
+    def translate_path(self, path):
+        path, _, query = path.partition('?')
+        parts = path.split('/')
+        key = []
+        for i, part in enumerate(parts):
+            if part.upper() in self.codes:
+                parts[i] = self.codes[part.upper()]
+                key.append('*')
+            elif part.isdigit() or (i > 0 and parts[i - 1] == 'team'):
+                key.append('*')
+            else:
+                key.append(part)
+        return '/'.join(parts) + ('?' + query if query else ''), '/'.join(key)
+
+    async def http(self, method, path, body, created=None):
+        url, key = self.translate_path(path)
+        if isinstance(body, dict) and '_bytes' in body:
+            kwargs = {'data': b'\0' * body['_bytes']}
+        elif body is not None:
+            kwargs = {'json': self.translate(body)}
+        else:
+            kwargs = {}
+        started = time.perf_counter()
+        try:
+            async with self.session.request(method, self.base + url, **kwargs) as r:
+                data = await r.read()
+                status = r.status
+        except aiohttp.ClientError:
+            self.failures += 1
+            if created is not None:
+                created.set_result(None)
+            return
+        self.latencies['%s %s' % (method, key)].append((time.perf_counter() - started) * 1000)
+        if status >= 500:
+            self.failures += 1
+        if created is not None:
+            created.set_result(json.loads(data).get('game_code') if status == 200 else None)
+
+    def socket(self, connection, event, data):
+        conn = self.connections.get(connection)
+        if conn is None:
+            conn = self.connections[connection] = Connection(self)
+        if event == 'connect':
+            return
+        conn.queue.put_nowait((event, self.translate(data)))
+        if event == 'disconnect':
+            del self.connections[connection]
+
+    async def fetch(self, url):
+        async with self.session.get(url) as r:
+            await r.read()
+
+    async def warm_up(self):
+        # Первые запросы к свежему процессу медленнее — прогреваем до начала замеров
+        for _ in range(3):
+            await asyncio.gather(*(self.fetch(self.base + '/api/load') for _ in range(20)))
+        ws = await websockets.connect(self.ws_url, compression=None)
+        await ws.close()
+
+    async def run(self, records):
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+        await self.warm_up()
+        started = time.perf_counter()
+        for record in records:
+            delay = started + record[0] / 1000 / self.speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if record[1] == 's':
+                self.socket(record[2], record[3], record[4])
+            elif record[1] == 'h':
+                created = None
+                if record[3] == '/api/create_game':
+                    # Код новой игры придёт в ответе; следующая запись 'g' его дождётся
+                    created = asyncio.get_running_loop().create_future()
+                    self.created.append(created)
+                self.start(self.http(record[2], record[3], record[4], created))
+            elif record[1] == 'g' and self.created:
+                code = await self.created.popleft()
+                if code is not None:
+                    self.codes[record[2]] = code
+        for connection in list(self.connections):
+            self.socket(connection, 'disconnect', None)
+        # Дожидаемся ответов, но не дольше самого длинного long-poll
+        if self.tasks:
+            await asyncio.wait(list(self.tasks), timeout=35)
+        for task in list(self.tasks):
+            task.cancel()
+        await self.session.close()
+        return time.perf_counter() - started
+
+
+def replay_build(root, backend, records, speed):
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        proc, worker = start_server(backend, port, tmp, root, speed)
+        try:
+            cpu_before, rss_before = cpu_seconds(worker), rss_kb(worker)
+            replay = Replay(port, speed)
+            wall = asyncio.run(replay.run(records))
+            cpu = cpu_seconds(worker) - cpu_before
+            rss = rss_kb(worker) - rss_before
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(30)
+    return {'wall': wall, 'cpu': cpu, 'rss': rss, 'latencies': replay.latencies, 'errors': replay.errors,
+            'scored': replay.scored, 'failures': replay.failures}
+
+
+def report(root, r):
+    print('%s: %.1f с, CPU воркера %.2f с (%.0f%%), прирост RSS %d КБ, сбоев %d' % (
+        root, r['wall'], r['cpu'], 100 * r['cpu'] / r['wall'], r['rss'], r['failures']))
+    print('  ответов в итогах вопросов: %d' % r['scored'])
+    for key in sorted(r['latencies']):
+        values = r['latencies'][key]
+        print('  %-40s %6d  p50 %7.1f мс  p95 %7.1f мс' % (key, len(values), percentile(values, 0.5),
+                                                          percentile(values, 0.95)))
+    for message, count in r['errors'].most_common():
+        print('  ошибка «%s»: %d' % (message, count))
+
+
+def compare(a, b):
+    print('Разница (вторая сборка относительно первой):')
+    print('  CPU воркера: %+.1f%%' % (100 * (b['cpu'] - a['cpu']) / max(a['cpu'], 1e-6)))
+    for key in sorted(set(a['latencies']) & set(b['latencies'])):
+        a50, a95 = percentile(a['latencies'][key], 0.5), percentile(a['latencies'][key], 0.95)
+        b50, b95 = percentile(b['latencies'][key], 0.5), percentile(b['latencies'][key], 0.95)
+        print('  %-40s p50 %+6.1f%%  p95 %+6.1f%%' % (key, 100 * (b50 - a50) / max(a50, 1e-6),
+                                                      100 * (b95 - a95) / max(a95, 1e-6)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанного трафика и сравнение сборок')
+    parser.add_argument('recording')
+    parser.add_argument('--builds', nargs='+', default=[ROOT], help='каталоги сборок, не больше двух')
+    parser.add_argument('--speed', type=float, default=1.0, help='ускорение относительно записи')
+    parser.add_argument('--backend', default='gevent', choices=['gevent', 'asyncio'])
+    args = parser.parse_args()
+    if len(args.builds) > 2:
+        parser.error('сравниваются не больше двух сборок')
+    records = load_recording(args.recording)
+    print('Записей: %d, длительность %.1f с, ускорение x%g' % (
+        len(records), records[-1][0] / 1000 if records else 0, args.speed))
+    results = []
+    for root in args.builds:
+        results.append(replay_build(os.path.abspath(root), args.backend, records, args.speed))
+        report(root, results[-1])
+    if len(results) == 2:
+        compare(*results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from quiz_library import QuizLibrary
+
+
+def seed_database(path, quizzes, questions):
+    library = QuizLibrary(path)
+    for n in range(quizzes):
+        library.add_quiz('Викторина %d' % n, [{
+            'text': 'Вопрос %d-%d: %s' % (n, i, ' '.join(random.choice('абвгдежзик') * 5 for _ in range(12))),
+            'options': ('первый', 'второй', 'третий', 'четвёртый'),
+            'correct_answer': i % 4,
+            'time_limit': 30
+        } for i in range(questions)])
+    library.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url, deadline):
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                if r.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def children(pid):
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory(pid):
+    # Pss делит общие страницы между процессами, поэтому показывает реальную цену воркера
+    values = {}
+    with open('/proc/%d/smaps_rollup' % pid) as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:', 'Shared_Clean:', 'Shared_Dirty:', 'Private_Dirty:'):
+                values[parts[0][:-1]] = int(parts[1])
+    return values
+
+
+def run(preload, workers, database, timeout):
+    port = free_port()
+    env = dict(os.environ, QUIZ_DATABASE=database, QUIZ_BIND='127.0.0.1:%d' % port,
+               WEB_CONCURRENCY=str(workers), QUIZ_PRELOAD='1' if preload else '0',
+               QUIZ_MEDIA_ROOT=os.path.join(os.path.dirname(database), 'media'))
+    cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py')]
+    started = time.time()
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ok = wait_ready('http://127.0.0.1:%d/' % port, started + timeout)
+        ready = time.time() - started
+        # Ждём, пока поднимутся все воркеры, и даём каждому обработать запрос
+        deadline = time.time() + timeout
+        while len(children(proc.pid)) < workers and time.time() < deadline:
+            time.sleep(0.05)
+        for _ in range(workers * 4):
+            wait_ready('http://127.0.0.1:%d/api/quizzes' % port, time.time() + 5)
+        return ok, ready, memory(proc.pid), [memory(pid) for pid in children(proc.pid)]
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время старта и память воркеров gunicorn с preload и без')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--quizzes', type=int, default=200)
+    parser.add_argument('--questions', type=int, default=40)
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'quiz.db')
+        seed_database(database, args.quizzes, args.questions)
+        for preload in (True, False):
+            ok, ready, master, workers = run(preload, args.workers, database, args.timeout)
+            print('preload=%s: первый ответ через %.2f с%s' % (preload, ready, '' if ok else ' (не дождались)'))
+            print('  мастер: Rss %(Rss)d КБ, Pss %(Pss)d КБ' % master)
+            for i, w in enumerate(workers):
+                print('  воркер %d: Rss %d КБ, Pss %d КБ, общие %d КБ, свои %d КБ' % (
+                    i, w['Rss'], w['Pss'], w['Shared_Clean'] + w['Shared_Dirty'], w['Private_Dirty']))
+            if workers:
+                print('  сумма Pss воркеров: %d КБ' % sum(w['Pss'] for w in workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+
+import aiohttp
+import socketio
+import uvicorn
+
+# Классный ретранслятор: ставится в школе, принимает сокеты всех устройств класса и держит
+# к центральному серверу по одному соединению на игру.
+#   QUIZ_RELAY_TOKEN=... python edge_relay.py --upstream http://quiz.example.org:5000 --port 5000
+# Секрет тот же, что QUIZ_RELAY_TOKEN на сервере: только ретранслятору сервер верит возрасту ответов.
+# Устройства открывают страницу ретранслятора, дальше всё идёт через него:
+#   - кадры комнаты игры приходят по каналу один раз и раздаются классу локально;
+#   - личные сообщения приходят обёрнутыми в {'type': 'relay', 'to': номер клиента};
+#   - ответы копятся RELAY_ANSWER_INTERVAL секунд и уходят одной пачкой с возрастом каждого;
+#   - учитель и зрители проксируются один к одному, HTTP — как есть, неизменяемые
+#     ответы (медиа) кэшируются, чтобы картинка шла по каналу один раз на класс.
+
+RELAY_ANSWER_INTERVAL = 0.05
+UPLINK_IDLE = 30
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+HOP_HEADERS = ('host', 'connection', 'keep-alive', 'content-length', 'transfer-encoding', 'upgrade')
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+relay = None
+
+
+def pack(messages):
+    return messages[0] if len(messages) == 1 else {'type': 'batch', 'messages': messages}
+
+
+class GameUplink:
+    # Одно соединение с сервером на игру за всех игроков класса
+    def __init__(self, owner, game_code):
+        self.owner = owner
+        self.game_code = game_code
+        self.numbers = itertools.count()
+        self.clients = {}
+        self.sids = {}
+        self.joins = {}
+        self.answers = []
+        self.flushing = False
+        self.online = False
+        self.client = socketio.AsyncClient(handle_sigint=False)
+        self.client.on('connect', self.on_connect)
+        self.client.on('disconnect', self.on_disconnect)
+        self.client.on('message', self.on_message)
+        owner.start(self.client.connect(owner.upstream, transports=['websocket'], retry=True))
+
+    async def on_connect(self):
+        await self.client.emit('relay_join', {'game_code': self.game_code, 'token': self.owner.token})
+
+    async def on_disconnect(self, *args):
+        self.online = False
+
+    async def on_ready(self):
+        # После (пере)подключения заново представляем серверу всех игроков класса
+        self.online = True
+        for sid, data in list(self.joins.items()):
+            if sid in self.clients:
+                await self.client.emit('relay_event', {'client': self.clients[sid], 'event': 'player_join',
+                                                       'data': data})
+        await self.flush_answers()
+
+    async def on_message(self, payload):
+        messages = payload['messages'] if payload.get('type') == 'batch' else [payload]
+        shared = []
+        personal = {}
+        ready = False
+        for message in messages:
+            msg_type = message.get('type')
+            if msg_type == 'relay':
+                sid = self.sids.get(message['to'])
+                if sid is not None:
+                    personal.setdefault(sid, []).append(message['message'])
+            elif msg_type == 'relay_ready':
+                ready = True
+            else:
+                shared.append(message)
+        if shared:
+            await sio.emit('message', pack(shared), room=self.game_code)
+        for sid, items in personal.items():
+            await sio.emit('message', pack(items), to=sid)
+        if ready:
+            await self.on_ready()
+
+    async def join(self, sid, data):
+        if sid not in self.clients:
+            client = next(self.numbers)
+            self.clients[sid] = client
+            self.sids[client] = sid
+            await sio.enter_room(sid, self.game_code)
+        self.joins[sid] = data
+        if self.online:
+            await self.client.emit('relay_event', {'client': self.clients[sid], 'event': 'player_join', 'data': data})
+
+    async def request_question(self, sid):
+        if self.online:
+            await self.client.emit('relay_event', {'client': self.clients[sid], 'event': 'request_question'})
+
+    def answer(self, sid, data):
+        answer = data.get('answer') if isinstance(data, dict) else None
+        if type(answer) is not int:
+            return
+        self.answers.append((self.clients[sid], answer, asyncio.get_running_loop().time()))
+        if not self.flushing:
+            self.flushing = True
+            self.owner.start(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.owner.answer_interval)
+        self.flushing = False
+        await self.flush_answers()
+
+    async def flush_answers(self):
+        # Каждый ответ несёт свой возраст: сервер вычтет время ожидания в пачке из времени ответа
+        if not self.online or not self.answers:
+            return
+        now = asyncio.get_running_loop().time()
+        answers = [[client, answer, round(now - received, 3)] for client, answer, received in self.answers]
+        self.answers = []
+        await self.client.emit('relay_answers', {'answers': answers})
+
+    async def leave(self, sid):
+        client = self.clients.pop(sid)
+        del self.sids[client]
+        self.joins.pop(sid, None)
+        self.answers = [a for a in self.answers if a[0] != client]
+        if self.online:
+            await self.client.emit('relay_event', {'client': client, 'event': 'leave'})
+        if not self.clients:
+            self.owner.start(self.close_when_idle())
+
+    async def close_when_idle(self):
+        # Канал держим ещё немного: обновление страницы не должно пересоздавать соединение
+        await asyncio.sleep(UPLINK_IDLE)
+        if not self.clients and self.owner.uplinks.get(self.game_code) is self:
+            del self.owner.uplinks[self.game_code]
+            await self.client.disconnect()
+
+
+class Passthrough:
+    # Учитель и зрители получают собственное соединение с сервером, события идут как есть
+    def __init__(self, owner, sid):
+        self.sid = sid
+        self.closed = False
+        self.client = socketio.AsyncClient(reconnection=False, handle_sigint=False)
+        self.client.on('*', self.forward)
+        self.client.on('disconnect', self.on_disconnect)
+        self.connecting = owner.start(self.client.connect(owner.upstream, transports=['websocket']))
+
+    async def forward(self, event, data=None):
+        await sio.emit(event, data, to=self.sid)
+
+    async def on_disconnect(self, *args):
+        if not self.closed:
+            await sio.disconnect(self.sid)
+
+    async def emit(self, event, data):
+        try:
+            await self.connecting
+        except socketio.exceptions.ConnectionError:
+            await sio.emit('message', {'type': 'error', 'message': 'Сервер недоступен'}, to=self.sid)
+            return
+        await self.client.emit(event, data)
+
+    async def close(self):
+        self.closed = True
+        await self.client.disconnect()
+
+
+class EdgeRelay:
+    def __init__(self, upstream, token, answer_interval=RELAY_ANSWER_INTERVAL):
+        self.upstream = upstream.rstrip('/')
+        self.token = token
+        self.answer_interval = answer_interval
+        self.uplinks = {}
+        self.players = {}
+        self.direct = {}
+        self.cache = {}
+        self.cache_bytes = 0
+        self.tasks = set()
+        self.session = None
+
+    def start(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def player_join(self, sid, data):
+        if not isinstance(data, dict) or not isinstance(data.get('game_code'), str):
+            return
+        uplink = self.players.get(sid)
+        if uplink is not None and uplink.game_code != data['game_code']:
+            await self.player_leave(sid)
+            uplink = None
+        if uplink is None:
+            uplink = self.uplinks.get(data['game_code'])
+            if uplink is None:
+                uplink = self.uplinks[data['game_code']] = GameUplink(self, data['game_code'])
+            self.players[sid] = uplink
+        await uplink.join(sid, data)
+
+    async def player_leave(self, sid):
+        uplink = self.players.pop(sid)
+        await sio.leave_room(sid, uplink.game_code)
+        await uplink.leave(sid)
+
+    async def passthrough(self, sid, event, data):
+        link = self.direct.get(sid)
+        if link is None:
+            link = self.direct[sid] = Passthrough(self, sid)
+        await link.emit(event, data)
+
+    async def disconnect(self, sid):
+        if sid in self.players:
+            await self.player_leave(sid)
+        link = self.direct.pop(sid, None)
+        if link is not None:
+            await link.close()
+
+    # ---------- HTTP ----------
+    async def proxy(self, scope, receive, send):
+        url = self.upstream + scope['path']
+        if scope['query_string']:
+            url += '?' + scope['query_string'].decode('latin-1')
+        method = scope['method']
+        cached = self.cache.get(url) if method == 'GET' else None
+        if cached is not None:
+            return await respond(send, *cached)
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        headers = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']
+                   if k.decode('latin-1').lower() not in HOP_HEADERS]
+        if self.session is None:
+            # Сжатые ответы отдаём как есть, длинный опрос статуса держит запрос до 30 секунд
+            self.session = aiohttp.ClientSession(auto_decompress=False,
+                                                 timeout=aiohttp.ClientTimeout(total=None, sock_read=90))
+        try:
+            async with self.session.request(method, url, data=body or None, headers=headers,
+                                            allow_redirects=False) as r:
+                data = await r.read()
+                result = (r.status, [(k, v) for k, v in r.headers.items() if k.lower() not in HOP_HEADERS], data)
+                immutable = 'immutable' in r.headers.get('Cache-Control', '')
+        except aiohttp.ClientError:
+            body = json.dumps({'success': False, 'message': 'Сервер недоступен'}).encode('utf-8')
+            return await respond(send, 502, [('Content-Type', 'application/json')], body)
+        if method == 'GET' and result[0] == 200 and immutable and self.cache_bytes + len(data) <= CACHE_MAX_BYTES:
+            self.cache[url] = result
+            self.cache_bytes += len(data)
+        await respond(send, *result)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+async def respond(send, status, headers, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+                   + [(b'content-length', str(len(body)).encode('ascii'))]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+@sio.on('player_join')
+async def handle_player_join(sid, data):
+    await relay.player_join(sid, data)
+
+
+@sio.on('request_question')
+async def handle_request_question(sid, data=None):
+    uplink = relay.players.get(sid)
+    if uplink is not None:
+        await uplink.request_question(sid)
+
+
+@sio.on('submit_answer')
+async def handle_submit_answer(sid, data):
+    uplink = relay.players.get(sid)
+    if uplink is not None:
+        uplink.answer(sid, data)
+
+
+@sio.on('disconnect')
+async def handle_disconnect(sid, *args):
+    await relay.disconnect(sid)
+
+
+@sio.on('*')
+async def handle_other(event, sid, data=None):
+    await relay.passthrough(sid, event, data)
+
+
+async def http_app(scope, receive, send):
+    if scope['type'] == 'http':
+        await relay.proxy(scope, receive, send)
+
+
+def create_relay_app(upstream, token, answer_interval=RELAY_ANSWER_INTERVAL):
+    global relay
+    relay = EdgeRelay(upstream, token, answer_interval)
+    return socketio.ASGIApp(sio, other_asgi_app=http_app, on_shutdown=relay.close)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Классный ретранслятор викторины')
+    parser.add_argument('--upstream', required=True, help='адрес центрального сервера, например http://10.0.0.5:5000')
+    parser.add_argument('--token', default=os.environ.get('QUIZ_RELAY_TOKEN'),
+                        help='секрет ретрансляторов, как QUIZ_RELAY_TOKEN на сервере')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--answer-interval', type=float, default=RELAY_ANSWER_INTERVAL,
+                        help='сколько секунд копить ответы перед отправкой пачкой')
+    args = parser.parse_args()
+    if not args.token:
+        parser.error('укажите --token или QUIZ_RELAY_TOKEN')
+    print('Ретранслятор на http://%s:%d, сервер %s' % (args.host, args.port, args.upstream))
+    uvicorn.run(create_relay_app(args.upstream, args.token, args.answer_interval), host=args.host, port=args.port,
+                log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import random
+from collections import deque
+from threading import Lock
+
+# Коды игр: алфавит из 32 символов без похожих пар 0/O и 1/I, 5 бит на символ.
+# Код — номер из счётчика, пропущенный через биекцию на 5 * length битах со случайными
+# параметрами процесса: каждый номер выдаётся один раз, без проверок и повторов,
+# а соседние коды не похожи друг на друга. Освобождённые коды (выселенные игры) встают
+# в очередь и выдаются снова, когда счётчик исчерпан, — начиная с самых давних.
+# Необязательный префикс шарда в начале кода позволяет балансировщику направлять игру
+# в нужный воркер или сервер.
+
+ALPHABET = '23456789ABCDEFGHJKLMNPQRSTUVWXYZ'
+BITS_PER_CHAR = 5
+CHAR_INDEX = {c: i for i, c in enumerate(ALPHABET)}
+# Пары символов по 10 бит: код из 6 символов собирается за три обращения к таблице
+PAIRS = [a + b for a in ALPHABET for b in ALPHABET]
+
+
+class GameCodesExhausted(Exception):
+    pass
+
+
+class GameCodeAllocator:
+    def __init__(self, length=6, shard=''):
+        shard = shard.upper()
+        if any(c not in CHAR_INDEX for c in shard):
+            raise ValueError('Префикс шарда может содержать только символы ' + ALPHABET)
+        self.length = length
+        self.shard = shard
+        self.bits = BITS_PER_CHAR * length
+        self.mask = (1 << self.bits) - 1
+        self.size = 1 << self.bits
+        self.counter = 0
+        self.free = deque()
+        self.lock = Lock()
+        # Параметры биекции: нечётные множители обратимы по модулю 2^bits
+        self.a = random.getrandbits(self.bits) | 1
+        self.b = random.getrandbits(self.bits)
+        self.c = random.getrandbits(self.bits) | 1
+
+    def permute(self, n):
+        x = (n * self.a + self.b) & self.mask
+        x ^= x >> (self.bits // 2)
+        x = (x * self.c) & self.mask
+        x ^= x >> (self.bits // 3)
+        return x
+
+    def encode(self, n):
+        chunks = []
+        for _ in range(self.length // 2):
+            chunks.append(PAIRS[n & 1023])
+            n >>= 2 * BITS_PER_CHAR
+        if self.length % 2:
+            chunks.append(ALPHABET[n & 31])
+        return self.shard + ''.join(reversed(chunks))
+
+    def allocate(self):
+        with self.lock:
+            if self.counter < self.size:
+                n = self.counter
+                self.counter += 1
+                return self.encode(self.permute(n))
+            if self.free:
+                return self.free.popleft()
+        raise GameCodesExhausted('Нет свободных кодов игр')
+
+    def release(self, code):
+        if self.owns(code):
+            with self.lock:
+                self.free.append(code)
+
+    def owns(self, code):
+        return len(code) == len(self.shard) + self.length and code.startswith(self.shard) \
+            and all(c in CHAR_INDEX for c in code[len(self.shard):])
+
+    def available(self):
+        return self.size - self.counter + len(self.free)
@@ -0,0 +1,842 @@
+import base64
+import json
+import os
+import random
+import struct
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+from game_codes import GameCodesExhausted
+from media_store import media_kind
+from quiz_library import QuizValidationError, normalize_questions
+
+# Ядро игры не знает, под каким рантаймом работает. Всё общение с внешним миром идёт
+# через транспорт:
+#   send(payload, room)          — буферизованная отправка в комнату (sid — тоже комната)
+#   send_optional(payload, room) — то же, но можно отбросить под нагрузкой
+#   join(sid, room) / leave(sid, room)
+#   spawn(phase)                 — запустить фазу-генератор; фаза отдаёт паузы в секундах
+#   question_revealed(game_code, game)
+# gevent-бэкенд (Bro_helper) и asyncio-бэкенд (asgi_app) реализуют его по-своему.
+
+STATUS_FIELDS = ('title', 'status', 'players', 'current_question', 'total_questions')
+EVICT_BATCH = 16
+
+
+def imul32(a, b):
+    return (a * b) & 0xFFFFFFFF
+
+
+def option_permutation(seed, slot, q_idx, n):
+    # mulberry32 + Фишер–Йетс, тот же алгоритм в клиенте (optionPermutation)
+    a = (seed ^ imul32(slot + 1, 0x9E3779B1) ^ imul32(q_idx + 1, 0x85EBCA77)) & 0xFFFFFFFF
+    order = list(range(n))
+    for i in range(n - 1, 0, -1):
+        a = (a + 0x6D2B79F5) & 0xFFFFFFFF
+        t = imul32(a ^ (a >> 15), 1 | a)
+        t = ((t + imul32(t ^ (t >> 7), 61 | t)) & 0xFFFFFFFF) ^ t
+        j = (t ^ (t >> 14)) % (i + 1)
+        order[i], order[j] = order[j], order[i]
+    return order
+
+
+def keystream_xor(data, key):
+    # xorshift128, тот же генератор повторён в клиенте (revealPayload)
+    s0, s1, s2, s3 = struct.unpack('<4I', key)
+    out = bytearray(data)
+    for i in range(0, len(out), 4):
+        t, x = s3, s0
+        s3, s2, s1 = s2, s1, x
+        t ^= (t << 11) & 0xFFFFFFFF
+        t ^= t >> 8
+        s0 = t ^ x ^ (x >> 19)
+        for j, b in enumerate(s0.to_bytes(4, 'little')[:len(out) - i]):
+            out[i + j] ^= b
+    return bytes(out)
+
+
+def host_room(game_code):
+    return game_code + ':host'
+
+
+def relay_sid(sid, client):
+    # Клиент за классным ретранслятором: своего сокета у него нет, адрес — сокет ретранслятора и номер
+    return '%s/%s' % (sid, client)
+
+
+def media_payload(name):
+    return {'url': '/media/' + name, 'kind': media_kind(name)}
+
+
+class GameManager:
+    # event_factory — событие рантайма (gevent или asyncio), на нём ждут long-poll запросы
+    def __init__(self, event_factory):
+        self.event_factory = event_factory
+        self.games = {}
+        self.questions = {}
+        self.player_scores = {}
+        self.question_timers = {}
+        self.auto_next_timers = {}
+        self.option_orders = {}
+        self.versions = {}
+        self.version_events = {}
+        self.player_index = {}
+        # Игры в порядке последнего изменения: самые давние — в начале
+        self.activity = OrderedDict()
+        self.lock = Lock()
+
+    def create_game(self, game_code, title, questions, season=None):
+        # questions уже проверены normalize_questions или взяты из кэша библиотеки;
+        # записи общие и не копируются, порядок вариантов считается для каждого игрока отдельно
+        questions = list(questions)
+        with self.lock:
+            self.games[game_code] = {
+                "title": title,
+                "status": "waiting",
+                "players": [],
+                "current_question": 0,
+                "scores": {},
+                "created_at": datetime.now().isoformat(),
+                "host_connected": False,
+                "question_active": False,
+                "answers": {},
+                "question_start_time": None,
+                "question_start_mono": None,
+                "question_end_time": None,
+                "server_start_time": None,
+                "server_time_limit": 0,
+                "results_shown": False,
+                "total_questions": len(questions),
+                "run_id": str(uuid.uuid4()),
+                "season": season,
+                "seed": random.getrandbits(32)
+            }
+            self.questions[game_code] = questions
+            self.player_scores[game_code] = {}
+            self.player_index[game_code] = {}
+            self.option_orders.pop(game_code, None)
+            self.touch(game_code)
+
+    def join_game(self, game_code, team_name):
+        with self.lock:
+            game = self.games.get(game_code)
+            if not game or game["status"] != "waiting":
+                return False
+            existing_player = self.player_index[game_code].get(team_name)
+            if existing_player:
+                if not existing_player["connected"]:
+                    existing_player["connected"] = True
+                    self.touch(game_code)
+                    return True
+                else:
+                    return False
+            player = {
+                "id": str(uuid.uuid4()),
+                "slot": len(game["players"]),
+                "name": team_name,
+                "score": 0,
+                "connected": True,
+                "last_answer": None,
+                "answer_time": None,
+                "joined_at": datetime.now().isoformat()
+            }
+            game["players"].append(player)
+            self.player_index[game_code][team_name] = player
+            game["scores"][team_name] = 0
+            self.player_scores[game_code][team_name] = 0
+            self.touch(game_code)
+            return True
+
+    def disconnect_player(self, game_code, player_name):
+        with self.lock:
+            game = self.games.get(game_code)
+            if not game:
+                return
+            player = self.player_index[game_code].get(player_name)
+            if player:
+                player["connected"] = False
+                self.touch(game_code)
+
+    def get_game(self, game_code):
+        return self.games.get(game_code)
+
+    def find_player(self, game_code, player_name):
+        return self.player_index.get(game_code, {}).get(player_name)
+
+    def touch(self, game_code):
+        # Версия растёт при каждом видимом изменении игры и будит ожидающие long-poll запросы
+        self.versions[game_code] = self.versions.get(game_code, 0) + 1
+        self.activity[game_code] = time.monotonic()
+        self.activity.move_to_end(game_code)
+        event = self.version_events.pop(game_code, None)
+        if event is not None:
+            event.set()
+
+    def stale_games(self, before, limit):
+        stale = []
+        for game_code, last in self.activity.items():
+            if last >= before or len(stale) >= limit:
+                break
+            stale.append(game_code)
+        return stale
+
+    def evict_game(self, game_code):
+        with self.lock:
+            if self.games.pop(game_code, None) is None:
+                return False
+            for table in (self.questions, self.player_scores, self.player_index, self.option_orders,
+                          self.versions, self.question_timers, self.auto_next_timers, self.activity):
+                table.pop(game_code, None)
+            event = self.version_events.pop(game_code, None)
+        if event is not None:
+            # Ожидающие long-poll запросы сразу получат «Игра не найдена»
+            event.set()
+        return True
+
+    def change_event(self, game_code, since):
+        # None — изменение уже есть; иначе событие, которое сработает при следующем touch
+        if self.versions.get(game_code, 0) > since:
+            return None
+        event = self.version_events.get(game_code)
+        if event is None:
+            event = self.version_events[game_code] = self.event_factory()
+        return event
+
+    def option_order(self, game_code, slot, q_idx):
+        # Кэш перестановок живёт только пока идёт текущий вопрос
+        cached = self.option_orders.get(game_code)
+        if cached is None or cached[0] != q_idx:
+            cached = self.option_orders[game_code] = (q_idx, {})
+        order = cached[1].get(slot)
+        if order is None:
+            game = self.games[game_code]
+            n = len(self.questions[game_code][q_idx]["options"])
+            order = cached[1][slot] = option_permutation(game["seed"], slot, q_idx, n)
+        return order
+
+    def clear_option_orders(self, game_code):
+        self.option_orders.pop(game_code, None)
+
+    def start_game(self, game_code):
+        with self.lock:
+            game = self.games.get(game_code)
+            if not game or len(game["players"]) == 0:
+                return False
+            game["status"] = "active"
+            self.touch(game_code)
+            return True
+
+    def reset_game(self, game_code):
+        with self.lock:
+            game = self.games.get(game_code)
+            if not game or game['status'] != 'finished':
+                return
+            if game_code in self.question_timers:
+                del self.question_timers[game_code]
+            if game_code in self.auto_next_timers:
+                del self.auto_next_timers[game_code]
+
+            old = game
+            self.games[game_code] = {
+                "title": old["title"],
+                "status": "waiting",
+                "players": [],
+                "current_question": 0,
+                "scores": {},
+                "created_at": datetime.now().isoformat(),
+                "host_connected": False,
+                "question_active": False,
+                "answers": {},
+                "question_start_time": None,
+                "question_start_mono": None,
+                "question_end_time": None,
+                "server_start_time": None,
+                "server_time_limit": 0,
+                "results_shown": False,
+                "total_questions": old["total_questions"],
+                "run_id": str(uuid.uuid4()),
+                "season": old["season"],
+                "seed": random.getrandbits(32)
+            }
+            self.player_scores[game_code] = {}
+            self.player_index[game_code] = {}
+            self.option_orders.pop(game_code, None)
+            self.touch(game_code)
+
+
+class Outbox:
+    # Всё, что отправлено в комнату за один тик планировщика, уходит клиентам одним кадром.
+    # schedule(room) должен запустить сброс, когда текущий обработчик или фаза отдаст управление
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.rooms = {}
+
+    def put(self, payload, room):
+        messages = self.rooms.get(room)
+        if messages is None:
+            messages = self.rooms[room] = []
+            self.schedule(room)
+        messages.append(payload)
+
+    def take(self, room):
+        messages = self.rooms.pop(room, None)
+        if not messages:
+            return None
+        return messages[0] if len(messages) == 1 else {'type': 'batch', 'messages': messages}
+
+
+class GameEngine:
+    def __init__(self, manager, config, transport):
+        self.manager = manager
+        self.config = config
+        self.transport = transport
+        self.archive = None
+        self.leaderboard = None
+        self.codes = None
+        self.sid_to_player = {}
+        self.answer_buckets = {}
+        self.stats_pending = set()
+        self.roster_pending = {}
+        self.relays = {}
+        self.relay_routes = {}
+
+    def spawn(self, phase):
+        speed = self.config['GAME_SPEED']
+        return self.transport.spawn(phase if speed == 1 else (delay / speed for delay in phase))
+
+    def scaled(self, seconds):
+        # Часы игры ускоряются только при воспроизведении записей (benchmarks/replay.py --speed)
+        speed = self.config['GAME_SPEED']
+        return seconds if speed == 1 else seconds / speed
+
+    # ---------- HTTP ----------
+    def create_game(self, data, library):
+        if data.get('quiz_id') is not None:
+            try:
+                quiz = library.get_quiz(int(data['quiz_id']))
+            except (TypeError, ValueError):
+                quiz = None
+            if not quiz:
+                return {'success': False, 'message': 'Викторина не найдена'}, 404
+            title = str(data.get('title') or '').strip()[:200] or quiz['title']
+            questions = quiz['questions']
+        else:
+            title = str(data.get('title', '')).strip()[:200]
+            if not title:
+                return {'success': False, 'message': 'Введите название игры'}, 400
+            try:
+                questions = normalize_questions(data.get('questions'))
+            except QuizValidationError as e:
+                return {'success': False, 'message': str(e)}, 400
+        self.evict_stale_games()
+        try:
+            game_code = self.codes.allocate()
+        except GameCodesExhausted as e:
+            return {'success': False, 'message': str(e)}, 503
+        season = str(data.get('season') or self.config['SEASON']).strip()[:64]
+        self.manager.create_game(game_code, title, questions, season)
+        return {'success': True, 'game_code': game_code}, 200
+
+    def evict_stale_games(self):
+        # Игры сами не удаляются: при создании новой выселяем несколько самых давно не менявшихся
+        # и возвращаем их коды в пул
+        before = time.monotonic() - self.config['GAME_TTL']
+        for game_code in self.manager.stale_games(before, EVICT_BATCH):
+            if self.manager.evict_game(game_code):
+                self.codes.release(game_code)
+
+    def join_game(self, game_code, team_name):
+        if self.manager.join_game(game_code, team_name):
+            return {'success': True}, 200
+        game = self.manager.get_game(game_code)
+        if not game:
+            return {'success': False, 'message': 'Игра не найдена'}, 404
+        if game['status'] != 'waiting':
+            return {'success': False, 'message': 'Игра уже началась'}, 400
+        return {'success': False, 'message': 'Имя команды уже занято или игра недоступна'}, 400
+
+    def status_body(self, game_code, game, fields):
+        version = self.manager.versions.get(game_code, 0)
+        etag = '%s.%d.%s' % (game['run_id'][:8], version, '-'.join(fields))
+        body = {'success': True, 'version': version, 'game': {
+            f: game['players'] if f == 'players' else game.get(f, 0) for f in fields
+        }}
+        return version, etag, body
+
+    # ---------- Сообщения сокета ----------
+    def error(self, sid, message):
+        self.unicast({'type': 'error', 'message': message}, sid)
+
+    def unicast(self, payload, sid):
+        # Сообщения клиенту за ретранслятором уходят в общий сокет с номером адресата;
+        # за один тик они склеиваются в один кадр, как и всё остальное
+        route = self.relay_routes.get(sid)
+        if route is None:
+            self.transport.send(payload, sid)
+        else:
+            self.transport.send({'type': 'relay', 'to': route[1], 'message': payload}, route[0])
+
+    def teacher_join(self, sid, data):
+        game_code = data['game_code']
+        game = self.manager.get_game(game_code)
+        if not game:
+            self.error(sid, 'Игра не найдена')
+            return
+        game['host_connected'] = True
+        self.transport.join(sid, game_code)
+        self.transport.join(sid, host_room(game_code))
+        self.sid_to_player[sid] = (game_code, 'host')
+        self.unicast({'type': 'connected', 'game_code': game_code}, sid)
+
+    def player_join(self, sid, data):
+        game_code = data['game_code']
+        player_name = data['player_name']
+        game = self.manager.get_game(game_code)
+        if not game:
+            self.error(sid, 'Игра не найдена')
+            return
+        player = self.manager.find_player(game_code, player_name)
+        if not player:
+            self.error(sid, 'Игрок не зарегистрирован')
+            return
+
+        player['connected'] = True
+        self.manager.touch(game_code)
+        if sid not in self.relay_routes:
+            # Ретранслятор уже сидит в комнате игры и раздаёт её кадры своим клиентам сам
+            self.transport.join(sid, game_code)
+        self.sid_to_player[sid] = (game_code, player_name)
+        self.unicast({'type': 'player_info', 'seed': game['seed'], 'slot': player['slot']}, sid)
+
+        self.schedule_roster_update(game_code, 'player_joined', player_name)
+        self.send_current_question(sid, game_code, game)
+
+    def request_question(self, sid):
+        # Клиент пропустил подготовленный вопрос (переподключение) — отдаём его целиком
+        entry = self.sid_to_player.get(sid)
+        if not entry or entry[1] == 'host':
+            return
+        game = self.manager.get_game(entry[0])
+        if game:
+            self.send_current_question(sid, entry[0], game)
+
+    def send_current_question(self, sid, game_code, game):
+        if game['status'] != 'active' or not game.get('question_active'):
+            return
+        questions = self.manager.questions[game_code]
+        q_idx = game['current_question']
+        if q_idx >= len(questions):
+            return
+        self.unicast({
+            'type': 'server_time_update',
+            'server_time': int(time.time() * 1000),
+            'time_limit': questions[q_idx]['time_limit'],
+            'start_time': game.get('server_start_time', int(time.time() * 1000))
+        }, sid)
+        self.unicast({'type': 'show_question', 'question': self.question_payload(game_code, q_idx)}, sid)
+
+    def disconnect(self, sid):
+        relay = self.relays.pop(sid, None)
+        if relay is not None:
+            for client in list(relay[1]):
+                self.disconnect(relay_sid(sid, client))
+            return
+        self.answer_buckets.pop(sid, None)
+        route = self.relay_routes.pop(sid, None)
+        if route is not None:
+            self.relays.get(route[0], (None, set()))[1].discard(route[1])
+        entry = self.sid_to_player.pop(sid, None)
+        if entry is None:
+            return
+        game_code, player_name = entry
+        if player_name == 'host':
+            game = self.manager.get_game(game_code)
+            if game:
+                game['host_connected'] = False
+        else:
+            self.manager.disconnect_player(game_code, player_name)
+            game = self.manager.get_game(game_code)
+            if game:
+                self.schedule_roster_update(game_code, 'player_left', player_name)
+
+    def host_message(self, sid, data):
+        game_code = data.get('game_code')
+        if not game_code:
+            self.error(sid, 'Нет кода игры')
+            return
+        game = self.manager.get_game(game_code)
+        if not game:
+            self.error(sid, 'Игра не найдена')
+            return
+        msg_type = data.get('type')
+        if msg_type == 'start_game':
+            if len(game['players']) == 0:
+                self.error(sid, 'Нет игроков')
+                return
+            if self.manager.start_game(game_code):
+                game['status'] = 'active'
+                game['current_question'] = 0
+                self.archive.start_run(game['run_id'], game_code, game['title'])
+                self.transport.send({'type': 'game_started', 'message': 'Игра начинается...'}, game_code)
+                self.spawn(self.start_first_question(game_code))
+        elif msg_type in ('show_question_results', 'end_question_early'):
+            game['question_active'] = False
+            self.spawn(self.calculate_and_send_results(game_code, True))
+        elif msg_type == 'end_game':
+            self.transport.send({'type': 'game_ended'}, game_code)
+            self.spawn(self.end_game(game_code))
+
+    def allow_answer(self, sid):
+        # Token bucket на сокет: всплеск ANSWER_BURST, дальше ANSWER_RATE в секунду
+        now = time.monotonic()
+        bucket = self.answer_buckets.get(sid)
+        if bucket is None:
+            bucket = self.answer_buckets[sid] = [self.config['ANSWER_BURST'], now]
+        tokens = min(self.config['ANSWER_BURST'], bucket[0] + (now - bucket[1]) * self.config['ANSWER_RATE'])
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def submit_answer(self, sid, data, delay=0.0):
+        # Дешёвые проверки идут первыми: поток мусора отбрасывается без аллокаций и рассылок
+        entry = self.sid_to_player.get(sid)
+        if entry is None or entry[1] == 'host' or not isinstance(data, dict):
+            return
+        answer_index = data.get('answer')
+        if type(answer_index) is not int or not self.allow_answer(sid):
+            return
+        game_code, player_name = entry
+        game = self.manager.get_game(game_code)
+        if not game:
+            return
+        if not game.get('question_active'):
+            self.error(sid, 'Время ответа истекло')
+            return
+        # Время ответа считает сервер по монотонным часам от старта вопроса;
+        # delay — сколько ответ пролежал в пакете ретранслятора до отправки
+        time_limit = game['server_time_limit']
+        elapsed = max(0.0, time.monotonic() - delay - game['question_start_mono'])
+        if elapsed > time_limit + self.config['ANSWER_GRACE']:
+            self.error(sid, 'Время ответа истекло')
+            return
+        previous = game['answers'].get(player_name)
+        if previous is not None and previous['changes'] >= self.config['MAX_ANSWER_CHANGES']:
+            return
+        player = self.manager.find_player(game_code, player_name)
+        if not player:
+            return
+        # Клиент присылает позицию кнопки в своём порядке — переводим в исходный индекс варианта
+        order = self.manager.option_order(game_code, player['slot'], game['current_question'])
+        if not 0 <= answer_index < len(order):
+            return
+        answer_index = order[answer_index]
+        time_left = round(max(0.0, time_limit - elapsed), 3)
+        game['answers'][player_name] = {
+            'answer': answer_index,
+            'time_left': time_left,
+            'response_time': round(elapsed, 3),
+            'changes': 0 if previous is None else previous['changes'] + 1
+        }
+        player['last_answer'] = answer_index
+        player['answer_time'] = time_left
+        self.manager.touch(game_code)
+        self.unicast({'type': 'answer_received'}, sid)
+        self.schedule_stats_update(game_code)
+
+    def schedule_stats_update(self, game_code):
+        # Статистику для учителя шлём не на каждый ответ, а не чаще раза в STATS_INTERVAL
+        if game_code in self.stats_pending:
+            return
+        self.stats_pending.add(game_code)
+        self.spawn(self.send_stats_update(game_code))
+
+    def schedule_roster_update(self, game_code, msg_type, player_name):
+        # Список команд рассылаем не на каждый вход и выход, а раз в ROSTER_INTERVAL:
+        # при массовом подключении каждый клиент иначе получил бы N копий растущего списка
+        pending = game_code in self.roster_pending
+        self.roster_pending[game_code] = (msg_type, player_name)
+        if not pending:
+            self.spawn(self.send_roster_update(game_code))
+
+    # ---------- Классный ретранслятор ----------
+    # Ретранслятор держит один сокет на игру за всех своих клиентов: кадры комнаты игры
+    # получает один раз, личные сообщения — обёрнутыми в {'type': 'relay', 'to': номер},
+    # а ответы присылает пачками
+    def relay_join(self, sid, data):
+        token = self.config['RELAY_TOKEN']
+        if not isinstance(data, dict) or not token or data.get('token') != token:
+            self.error(sid, 'Доступ запрещён')
+            return
+        game_code = data.get('game_code')
+        if not self.manager.get_game(game_code):
+            self.error(sid, 'Игра не найдена')
+            return
+        self.relays[sid] = (game_code, set())
+        self.transport.join(sid, game_code)
+        self.transport.send({'type': 'relay_ready', 'game_code': game_code}, sid)
+
+    def relay_event(self, sid, data):
+        relay = self.relays.get(sid)
+        if relay is None or not isinstance(data, dict):
+            return
+        client = data.get('client')
+        if type(client) is not int:
+            return
+        target = relay_sid(sid, client)
+        event = data.get('event')
+        if event == 'player_join':
+            payload = data.get('data')
+            if not isinstance(payload, dict) or payload.get('game_code') != relay[0]:
+                return
+            relay[1].add(client)
+            self.relay_routes[target] = (sid, client)
+            self.player_join(target, payload)
+        elif event == 'request_question':
+            self.request_question(target)
+        elif event == 'leave':
+            self.disconnect(target)
+
+    def relay_answers(self, sid, data):
+        relay = self.relays.get(sid)
+        if relay is None or not isinstance(data, dict) or not isinstance(data.get('answers'), list):
+            return
+        max_delay = self.config['RELAY_MAX_DELAY']
+        for item in data['answers']:
+            if not isinstance(item, list) or len(item) != 3 or type(item[0]) is not int or item[0] not in relay[1]:
+                continue
+            client, answer, age = item
+            if not isinstance(age, (int, float)):
+                continue
+            self.submit_answer(relay_sid(sid, client), {'answer': answer}, min(max(0.0, age), max_delay))
+
+    # ---------- Фазы игры ----------
+    # Фазы — генераторы: yield отдаёт паузу в секундах, рантайм сам решает, как её выдержать
+    def send_stats_update(self, game_code):
+        yield self.config['STATS_INTERVAL']
+        self.stats_pending.discard(game_code)
+        game = self.manager.get_game(game_code)
+        if not game:
+            return
+        self.transport.send_optional({
+            'type': 'question_stats_update',
+            'answers_received': len(game['answers']),
+            'total_players': sum(1 for p in game['players'] if p['connected'])
+        }, host_room(game_code))
+
+    def send_roster_update(self, game_code):
+        yield self.config['ROSTER_INTERVAL']
+        msg_type, player_name = self.roster_pending.pop(game_code)
+        game = self.manager.get_game(game_code)
+        if game:
+            self.transport.send({'type': msg_type, 'player': player_name, 'players': game['players']}, game_code)
+
+    def end_game(self, game_code):
+        yield 0.5
+        self.manager.reset_game(game_code)
+
+    def question_payload(self, game_code, q_idx):
+        questions = self.manager.questions[game_code]
+        q = questions[q_idx]
+        payload = {
+            'text': q['text'],
+            'options': q['options'],
+            'time_limit': q['time_limit'],
+            'question_number': q_idx + 1,
+            'total_questions': len(questions)
+        }
+        if q.get('media'):
+            payload['media'] = media_payload(q['media'])
+        return payload
+
+    def stage_question(self, game_code, q_idx):
+        # Рассылаем зашифрованный вопрос заранее, при старте уходит только ключ
+        game = self.manager.get_game(game_code)
+        if not game or q_idx >= game['total_questions']:
+            return
+        key = os.urandom(16)
+        while not any(key):
+            key = os.urandom(16)
+        data = json.dumps(self.question_payload(game_code, q_idx), ensure_ascii=False).encode('utf-8')
+        game['staged'] = {'stage_id': q_idx, 'key': key.hex()}
+        message = {
+            'type': 'stage_question',
+            'stage_id': q_idx,
+            'payload': base64.b64encode(keystream_xor(data, key)).decode('ascii')
+        }
+        media = self.manager.questions[game_code][q_idx].get('media')
+        if media:
+            # Медиа грузится во время отсчёта, к моменту показа оно уже в кэше браузера
+            message['preload'] = media_payload(media)
+        self.transport.send(message, game_code)
+
+    def start_first_question(self, game_code):
+        self.stage_question(game_code, 0)
+        yield self.config['GAME_START_DELAY']
+        self.show_question_to_all(game_code)
+
+    def show_question_to_all(self, game_code):
+        game = self.manager.get_game(game_code)
+        if not game: return
+        questions = self.manager.questions[game_code]
+        q_idx = game['current_question']
+        if q_idx >= len(questions): return
+        q = questions[q_idx]
+        # Все клиенты стартуют в один момент: чуть позже раскрытия, с поправкой на часы
+        lead = self.scaled(self.config['REVEAL_LEAD'])
+        start = time.time() + lead
+        game['question_active'] = True
+        game['answers'] = {}
+        game['question_start_time'] = start
+        game['question_start_mono'] = time.monotonic() + lead
+        game['server_start_time'] = int(start * 1000)
+        game['server_time_limit'] = self.scaled(q['time_limit'])
+        game['results_shown'] = False
+        self.manager.clear_option_orders(game_code)
+        self.manager.touch(game_code)
+        staged = game.pop('staged', None)
+        if staged and staged['stage_id'] == q_idx:
+            self.transport.send({
+                'type': 'reveal_question',
+                'stage_id': q_idx,
+                'key': staged['key'],
+                'start_time': game['server_start_time'],
+                'time_limit': game['server_time_limit'],
+                'server_time': int(time.time() * 1000)
+            }, game_code)
+        else:
+            self.transport.send({
+                'type': 'server_time_update',
+                'server_time': int(time.time() * 1000),
+                'time_limit': game['server_time_limit'],
+                'start_time': game['server_start_time']
+            }, game_code)
+            self.transport.send({'type': 'show_question', 'question': self.question_payload(game_code, q_idx)},
+                                game_code)
+        self.transport.question_revealed(game_code, game)
+        answers_received = len(game['answers'])
+        total_players = len([p for p in game['players'] if p['connected']])
+        self.transport.send({
+            'type': 'question_started',
+            'question_text': q['text'],
+            'question_number': q_idx + 1,
+            'total_questions': len(questions),
+            'time_limit': game['server_time_limit'],
+            'start_time': game['server_start_time'],
+            'server_time': int(time.time() * 1000),
+            'answers_received': answers_received,
+            'total_players': total_players
+        }, host_room(game_code))
+        self.manager.question_timers[game_code] = self.spawn(
+            self.question_timer_with_auto_results(game_code, game['server_time_limit'])
+        )
+
+    def question_timer_with_auto_results(self, game_code, time_limit):
+        game = self.manager.get_game(game_code)
+        if not game: return
+        end = game.get('question_start_time', time.time()) + time_limit
+        server_start = game.get('server_start_time', int(time.time() * 1000))
+        while time.time() < end and game.get('question_active', True):
+            yield 0.5
+            if not game.get('question_active'):
+                break
+            self.transport.send_optional({
+                'type': 'server_time_update',
+                'server_time': int(time.time() * 1000),
+                'time_limit': time_limit,
+                'start_time': server_start
+            }, game_code)
+        if game.get('question_active'):
+            game['question_active'] = False
+            self.transport.send({'type': 'question_ended'}, game_code)
+            self.transport.send({'type': 'question_completed'}, game_code)
+            yield 2
+            yield from self.calculate_and_send_results(game_code)
+
+    def calculate_and_send_results(self, game_code, is_manual=False):
+        game = self.manager.get_game(game_code)
+        if not game: return
+        questions = self.manager.questions[game_code]
+        q_idx = game['current_question']
+        if q_idx >= len(questions): return
+        q = questions[q_idx]
+        results = {
+            'question': q['text'],
+            'correct_answer': q['correct_answer'],
+            'answers': [],
+            'leaderboard': [],
+            'is_last_question': q_idx + 1 >= len(questions)
+        }
+        response_times = []
+        for player in game['players']:
+            ans = game['answers'].get(player['name'])
+            response_times.append(ans['response_time'] if ans else None)
+            if ans:
+                is_correct = ans['answer'] == q['correct_answer']
+                points = 0
+                if is_correct and ans['answer'] >= 0:
+                    base = 100
+                    bonus = int((ans['time_left'] / game['server_time_limit']) * 500)
+                    points = base + bonus
+                    player['score'] += points
+                results['answers'].append({
+                    'team': player['name'],
+                    'answer': ans['answer'],
+                    'answer_text': q['options'][ans['answer']] if 0 <= ans['answer'] < len(q['options']) else 'Нет ответа',
+                    'correct': is_correct,
+                    'points_earned': points,
+                    'total_score': player['score'],
+                    'time_left': ans['time_left']
+                })
+            else:
+                results['answers'].append({
+                    'team': player['name'],
+                    'answer': -1,
+                    'answer_text': 'Нет ответа',
+                    'correct': False,
+                    'points_earned': 0,
+                    'total_score': player['score'],
+                    'time_left': 0
+                })
+        for p in game['players']:
+            results['leaderboard'].append({'name': p['name'], 'score': p['score']})
+        results['leaderboard'].sort(key=lambda x: x['score'], reverse=True)
+        self.manager.touch(game_code)
+        final_results = [{'name': p['name'], 'score': p['score']} for p in game['players']]
+        final_results.sort(key=lambda x: x['score'], reverse=True)
+        self.transport.send({
+            'type': 'show_results',
+            'results': results,
+            'final_results': final_results,
+            'is_last_question': results['is_last_question']
+        }, game_code)
+        self.archive.record_question(game['run_id'], q_idx + 1, q['text'], results['answers'], response_times)
+        if not results['is_last_question']:
+            for sec in range(7, 0, -1):
+                yield 1
+                self.transport.send({'type': 'auto_next_countdown', 'seconds_left': sec}, game_code)
+                if sec == 7:
+                    self.stage_question(game_code, q_idx + 1)
+            yield 1
+            game['current_question'] += 1
+            game['question_active'] = False
+            game['results_shown'] = True
+            self.show_question_to_all(game_code)
+        else:
+            game['status'] = 'finished'
+            game['question_active'] = False
+            self.manager.touch(game_code)
+            self.archive.finish_run(game['run_id'])
+            self.leaderboard.record_game(game['season'], final_results)
+            yield 5
+            self.transport.send({'type': 'game_over', 'final_results': final_results, 'run_id': game['run_id']},
+                                game_code)
+            yield 10
+            current_game = self.manager.get_game(game_code)
+            if current_game and current_game['status'] == 'finished':
+                self.manager.reset_game(game_code)
@@ -0,0 +1,33 @@
+import os
+
+# Запуск в продакшене: gunicorn -c gunicorn.conf.py
+# Игры хранятся в памяти процесса, поэтому при нескольких воркерах все соединения
+# одной игры должны попадать в один воркер (sticky-сессии на балансировщике).
+# Номер воркера — символ кода игры сразу после префикса QUIZ_CODE_SHARD (или первый, если префикса нет)
+wsgi_app = 'Bro_helper:create_app()'
+bind = os.environ.get('QUIZ_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Воркер gevent-websocket, который отдаёт медиа через sendfile
+worker_class = 'sendfile_worker.SendfileWebSocketWorker'
+worker_connections = int(os.environ.get('QUIZ_WORKER_CONNECTIONS', 2000))
+# Приложение загружается в мастере: страница, сжатые ресурсы и кэш викторин
+# готовятся один раз и достаются воркерам через copy-on-write
+preload_app = os.environ.get('QUIZ_PRELOAD', '1') != '0'
+# Длинный опрос статуса держит запрос до STATUS_LONG_POLL_MAX секунд
+timeout = 60
+graceful_timeout = 20
+keepalive = 5
+
+
+def pre_fork(server, worker):
+    # Наименьший номер, не занятый живыми воркерами: по нему воркер получает свой символ
+    # в кодах игр, и коды разных воркеров не пересекаются (не больше 32 воркеров)
+    used = {w.code_slot for w in server.WORKERS.values()}
+    worker.code_slot = min(set(range(len(used) + 1)) - used)
+    import Bro_helper
+    Bro_helper.before_fork()
+
+
+def post_fork(server, worker):
+    import Bro_helper
+    Bro_helper.after_fork(worker.code_slot if server.num_workers > 1 else None)
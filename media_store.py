@@ -0,0 +1,127 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from werkzeug.http import parse_range_header
+
+MEDIA_TYPES = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'audio/mpeg': 'mp3',
+    'audio/ogg': 'ogg',
+    'audio/wav': 'wav',
+    'audio/x-wav': 'wav'
+}
+EXTENSION_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'mp3': 'audio/mpeg',
+    'ogg': 'audio/ogg',
+    'wav': 'audio/wav'
+}
+MEDIA_NAME = re.compile(r'^[0-9a-f]{64}\.(png|jpg|gif|webp|mp3|ogg|wav)$')
+CHUNK_SIZE = 64 * 1024
+
+
+class MediaError(ValueError):
+    pass
+
+
+def media_kind(name):
+    return EXTENSION_TYPES[name.rsplit('.', 1)[1]].split('/')[0]
+
+
+def media_range(range_header, if_range, etag, size):
+    # (статус, начало, длина) для GET /media. Поддерживается один диапазон; несколько диапазонов
+    # или If-Range с чужим ETag — отдаём файл целиком, диапазон за концом файла — 416
+    if not range_header or (if_range and if_range != etag):
+        return 200, 0, size
+    parsed = parse_range_header(range_header)
+    if parsed is None or len(parsed.ranges) != 1:
+        return 200, 0, size
+    bounds = parsed.range_for_length(size)
+    if bounds is None:
+        return 416, 0, 0
+    return 206, bounds[0], bounds[1] - bounds[0]
+
+
+class MediaFile:
+    # Тело ответа: кусок файла [offset, offset + length). Воркер с sendfile (sendfile_worker)
+    # отдаёт его из page cache прямо в сокет, остальные серверы читают кусками через итерацию
+    def __init__(self, path, offset, length):
+        self.path = path
+        self.file = None
+        self.offset = offset
+        self.length = length
+
+    def fileno(self):
+        # Файл открывается при отправке: на HEAD и 304 тело не нужно вовсе
+        if self.file is None:
+            self.file = open(self.path, 'rb')
+        return self.file.fileno()
+
+    def __iter__(self):
+        self.fileno()
+        self.file.seek(self.offset)
+        remaining = self.length
+        while remaining > 0:
+            chunk = self.file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class MediaStore:
+    def __init__(self, root, max_size=10 * 1024 * 1024):
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(root, exist_ok=True)
+
+    def save(self, stream, mimetype):
+        ext = MEDIA_TYPES.get(mimetype)
+        if ext is None:
+            raise MediaError('Неподдерживаемый тип файла')
+        # Пишем во временный файл и считаем хэш по ходу, чтобы не держать файл в памяти
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise MediaError('Файл слишком большой')
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            if size == 0:
+                raise MediaError('Пустой файл')
+            name = '%s.%s' % (digest.hexdigest(), ext)
+            path = os.path.join(self.root, name)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+            return name
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def path(self, name):
+        if not MEDIA_NAME.match(name):
+            return None
+        path = os.path.join(self.root, name)
+        return path if os.path.isfile(path) else None
@@ -0,0 +1,157 @@
+import sys
+import tracemalloc
+
+# Учёт памяти живых игр для /api/admin/memory: приблизительный удерживаемый размер
+# по играм и по структурам плюс поиск сирот — записей, которые уже никому не нужны,
+# но держат память (сокет ушёл, игра закончилась, таймер остался).
+
+# Структуры GameManager, ключ которых — код игры
+GAME_STRUCTURES = ('games', 'questions', 'player_scores', 'player_index', 'option_orders', 'versions',
+                   'version_events', 'question_timers', 'auto_next_timers', 'activity')
+CONTAINERS = (list, tuple, set, frozenset)
+ORPHAN_SAMPLE = 20
+
+
+def deep_size(obj, seen=None):
+    # Объект и всё, что достижимо через словари и коллекции; уже посчитанное в seen пропускается.
+    # Гринлеты, задачи и события считаются без содержимого
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, CONTAINERS):
+            stack.extend(o)
+    return size
+
+
+def game_sizes(engine, limit):
+    manager = engine.manager
+    result = []
+    for game_code, game in list(manager.games.items()):
+        # Общий seen на игру: игрок из players и из player_index считается один раз.
+        # Вопросы делят записи с кэшем библиотеки, поэтому их размер — верхняя оценка
+        seen = set()
+        structures = {}
+        for name in GAME_STRUCTURES:
+            value = getattr(manager, name).get(game_code)
+            if value is not None:
+                structures[name] = deep_size(value, seen)
+        if game_code in engine.roster_pending:
+            structures['roster_pending'] = deep_size(engine.roster_pending[game_code], seen)
+        result.append({
+            'game_code': game_code,
+            'status': game['status'],
+            'players': len(game['players']),
+            'bytes': sum(structures.values()),
+            'structures': structures
+        })
+    result.sort(key=lambda g: g['bytes'], reverse=True)
+    return result[:limit]
+
+
+def structure_sizes(engine, extra):
+    sizes = {name: {'entries': len(getattr(engine.manager, name)), 'bytes': deep_size(getattr(engine.manager, name))}
+             for name in GAME_STRUCTURES}
+    for name in ('sid_to_player', 'answer_buckets', 'stats_pending', 'roster_pending', 'relays', 'relay_routes'):
+        value = getattr(engine, name)
+        sizes[name] = {'entries': len(value), 'bytes': deep_size(value)}
+    for name, value in extra.items():
+        sizes[name] = {'entries': len(value), 'bytes': deep_size(value)}
+    return sizes
+
+
+def find_orphans(engine, is_connected, is_running, extra_sids):
+    # is_connected(sid) и is_running(handle) даёт бэкенд: сокеты и таймеры у рантаймов разные
+    manager = engine.manager
+
+    def connected(sid):
+        route = engine.relay_routes.get(sid)
+        return is_connected(route[0] if route else sid)
+
+    def active(game_code):
+        game = manager.games.get(game_code)
+        return game is not None and game['status'] == 'active' and game['question_active']
+
+    orphans = {
+        'sid_to_player_gone': [sid for sid in list(engine.sid_to_player) if not connected(sid)],
+        'sid_to_player_no_game': [sid for sid, (code, _) in list(engine.sid_to_player.items())
+                                  if code not in manager.games],
+        'answer_buckets_gone': [sid for sid in list(engine.answer_buckets) if not connected(sid)],
+        'relays_gone': [sid for sid in list(engine.relays) if not is_connected(sid)],
+        'version_events_no_game': [code for code in list(manager.version_events) if code not in manager.games],
+        'pending_no_game': sorted({code for code in list(engine.stats_pending) + list(engine.roster_pending)
+                                   if code not in manager.games})
+    }
+    for name in ('question_timers', 'auto_next_timers'):
+        # Завершённый таймер держит свой гринлет с кадром до следующего вопроса;
+        # работающий таймер у игры без активного вопроса — настоящая утечка
+        timers = getattr(manager, name)
+        orphans[name + '_finished'] = [code for code, handle in list(timers.items()) if not is_running(handle)]
+        orphans[name + '_running_inactive'] = [code for code, handle in list(timers.items())
+                                               if is_running(handle) and not active(code)]
+    for name, sids in extra_sids.items():
+        orphans[name + '_gone'] = [sid for sid in list(sids) if not is_connected(sid)]
+    return {name: {'count': len(found), 'sample': found[:ORPHAN_SAMPLE]} for name, found in orphans.items()}
+
+
+class AllocationTracker:
+    # Разница снимков tracemalloc между двумя вызовами: что выросло с прошлого раза
+    def __init__(self):
+        self.snapshot = None
+
+    @staticmethod
+    def take():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ))
+
+    def start(self, frames):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.snapshot = self.take()
+
+    def stop(self):
+        tracemalloc.stop()
+        self.snapshot = None
+
+    def diff(self, limit):
+        if self.snapshot is None or not tracemalloc.is_tracing():
+            return None
+        current = self.take()
+        # С глубиной стека больше 1 группируем по всей цепочке вызовов, иначе по строке
+        group = 'traceback' if tracemalloc.get_traceback_limit() > 1 else 'lineno'
+        stats = current.compare_to(self.snapshot, group)
+        self.snapshot = current
+        return [{
+            'where': [str(frame) for frame in stat.traceback],
+            'size_diff': stat.size_diff,
+            'size': stat.size,
+            'count_diff': stat.count_diff,
+            'count': stat.count
+        } for stat in stats[:limit]]
+
+    def status(self):
+        if not tracemalloc.is_tracing():
+            return {'tracing': False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {'tracing': True, 'traced': current, 'peak': peak, 'has_baseline': self.snapshot is not None}
+
+
+def process_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
@@ -0,0 +1,150 @@
+import codecs
+import csv
+import json
+import re
+
+MAX_LINE_BYTES = 1024 * 1024
+MAX_ITEM_CHARS = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+FORMATS = ('csv', 'json', 'ndjson')
+WHITESPACE = re.compile(r'\s*')
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def detect_format(explicit, filename, content_type):
+    if explicit:
+        return explicit.lower()
+    name = (filename or '').lower()
+    for fmt, ext in (('ndjson', '.ndjson'), ('ndjson', '.jsonl'), ('json', '.json'), ('csv', '.csv')):
+        if name.endswith(ext):
+            return fmt
+    content_type = (content_type or '').lower()
+    if 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    if 'json' in content_type:
+        return 'json'
+    return 'csv'
+
+
+def iter_lines(stream):
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    while True:
+        raw = stream.readline(MAX_LINE_BYTES)
+        if not raw:
+            break
+        if len(raw) >= MAX_LINE_BYTES and not raw.endswith(b'\n'):
+            raise ImportFormatError('Слишком длинная строка в файле')
+        yield decoder.decode(raw)
+
+
+def option_sort_key(name):
+    digits = re.sub(r'\D', '', name)
+    return int(digits) if digits else 0
+
+
+def iter_csv(stream):
+    # Заголовок: text, option1..optionN, correct_answer, time_limit, media
+    reader = csv.reader(iter_lines(stream))
+    try:
+        header = [h.strip().lower() for h in next(reader)]
+    except StopIteration:
+        return
+    if 'text' not in header or 'correct_answer' not in header:
+        raise ImportFormatError('В заголовке CSV нужны столбцы text и correct_answer')
+    option_columns = sorted((i for i, h in enumerate(header) if h.startswith('option')),
+                            key=lambda i: option_sort_key(header[i]))
+    text_col = header.index('text')
+    correct_col = header.index('correct_answer')
+    time_col = header.index('time_limit') if 'time_limit' in header else None
+    media_col = header.index('media') if 'media' in header else None
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        row += [''] * (len(header) - len(row))
+        question = {
+            'text': row[text_col],
+            'options': [row[i] for i in option_columns if row[i].strip()],
+            'correct_answer': row[correct_col].strip()
+        }
+        if time_col is not None and row[time_col].strip():
+            question['time_limit'] = row[time_col].strip()
+        if media_col is not None and row[media_col].strip():
+            question['media'] = row[media_col].strip()
+        yield reader.line_num, question
+
+
+def iter_ndjson(stream):
+    for line_num, line in enumerate(iter_lines(stream), 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_num, json.loads(line)
+        except ValueError:
+            yield line_num, None
+
+
+def iter_json_array(stream):
+    # Разбираем массив по одному элементу, не загружая файл целиком
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    buf = ''
+    pos = 0
+    eof = False
+    state = 'start'
+    row = 0
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+        has_data = pos < len(buf)
+        if state == 'end':
+            if has_data:
+                raise ImportFormatError('Лишние данные после JSON-массива')
+            if eof:
+                return
+        elif has_data:
+            ch = buf[pos]
+            if state == 'start':
+                if ch != '[':
+                    raise ImportFormatError('Ожидался JSON-массив вопросов')
+                pos += 1
+                state = 'first'
+                continue
+            if ch == ']' and state in ('first', 'next'):
+                pos += 1
+                state = 'end'
+                continue
+            if state == 'next':
+                if ch != ',':
+                    raise ImportFormatError('Некорректный JSON после элемента %d' % row)
+                pos += 1
+                state = 'item'
+                continue
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                item, end = None, None
+            if end is not None and (end < len(buf) or eof):
+                pos = end
+                row += 1
+                state = 'next'
+                yield row, item
+                continue
+            if eof:
+                raise ImportFormatError('Некорректный JSON в элементе %d' % (row + 1))
+            if len(buf) - pos > MAX_ITEM_CHARS:
+                raise ImportFormatError('Слишком большой элемент %d' % (row + 1))
+        elif eof:
+            raise ImportFormatError('Неожиданный конец JSON')
+        chunk = stream.read(CHUNK_SIZE)
+        eof = not chunk
+        buf = buf[pos:] + text_decoder.decode(chunk, final=eof)
+        pos = 0
+
+
+PARSERS = {
+    'csv': iter_csv,
+    'json': iter_json_array,
+    'ndjson': iter_ndjson
+}
@@ -0,0 +1,243 @@
+import json
+import sqlite3
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+from media_store import MEDIA_NAME
+
+MIN_OPTIONS = 2
+MAX_OPTIONS = 4
+MIN_TIME_LIMIT = 5
+MAX_TIME_LIMIT = 120
+MAX_TEXT_LENGTH = 1000
+
+
+class QuizValidationError(ValueError):
+    pass
+
+
+def normalize_question(q):
+    if not isinstance(q, dict):
+        raise QuizValidationError('Вопрос должен быть объектом')
+    text = q.get('text')
+    if not isinstance(text, str) or not text.strip():
+        raise QuizValidationError('Пустой текст вопроса')
+    if len(text) > MAX_TEXT_LENGTH:
+        raise QuizValidationError('Слишком длинный текст вопроса')
+    options = q.get('options')
+    if not isinstance(options, (list, tuple)) or not MIN_OPTIONS <= len(options) <= MAX_OPTIONS:
+        raise QuizValidationError('Нужно от %d до %d вариантов ответа' % (MIN_OPTIONS, MAX_OPTIONS))
+    options = tuple(str(o).strip() for o in options)
+    if not all(options):
+        raise QuizValidationError('Пустой вариант ответа')
+    if len(set(options)) != len(options):
+        raise QuizValidationError('Варианты ответа повторяются')
+    correct = q.get('correct_answer')
+    if isinstance(correct, str) and correct.strip().isdigit():
+        correct = int(correct)
+    if not isinstance(correct, int) or isinstance(correct, bool) or not 0 <= correct < len(options):
+        raise QuizValidationError('Индекс правильного ответа вне диапазона')
+    time_limit = q.get('time_limit', 30)
+    if isinstance(time_limit, str) and time_limit.strip().isdigit():
+        time_limit = int(time_limit)
+    if not isinstance(time_limit, int) or isinstance(time_limit, bool) \
+            or not MIN_TIME_LIMIT <= time_limit <= MAX_TIME_LIMIT:
+        raise QuizValidationError('Время на вопрос должно быть от %d до %d секунд' % (MIN_TIME_LIMIT, MAX_TIME_LIMIT))
+    normalized = {
+        'text': text.strip(),
+        'options': options,
+        'correct_answer': correct,
+        'time_limit': time_limit
+    }
+    media = q.get('media')
+    if media:
+        if not isinstance(media, str) or not MEDIA_NAME.match(media):
+            raise QuizValidationError('Некорректная ссылка на медиафайл')
+        normalized['media'] = media
+    return normalized
+
+
+def normalize_questions(questions):
+    if not isinstance(questions, list) or not questions:
+        raise QuizValidationError('Добавьте хотя бы один вопрос')
+    normalized = []
+    for i, q in enumerate(questions):
+        try:
+            normalized.append(normalize_question(q))
+        except QuizValidationError as e:
+            raise QuizValidationError('Вопрос %d: %s' % (i + 1, e))
+    return normalized
+
+
+def fts_query(text):
+    # Каждое слово — префиксный поиск, слова объединяются через AND
+    tokens = [t.replace('"', '""') for t in text.split()]
+    return ' '.join('"%s"*' % t for t in tokens if t)
+
+
+class QuizLibrary:
+    def __init__(self, path, cache_size=256):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        self.conn = None
+        self.connect()
+        self.conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS quizzes (
+                id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL,
+                question_count INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                ready INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                quiz_id INTEGER NOT NULL REFERENCES quizzes(id),
+                position INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                options TEXT NOT NULL,
+                correct_answer INTEGER NOT NULL,
+                time_limit INTEGER NOT NULL,
+                media TEXT
+            );
+            CREATE INDEX IF NOT EXISTS questions_quiz ON questions(quiz_id, position);
+            CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+                quiz_id UNINDEXED, title, text, options
+            );
+        ''')
+        columns = [r[1] for r in self.conn.execute('PRAGMA table_info(questions)')]
+        if 'media' not in columns:
+            self.conn.execute('ALTER TABLE questions ADD COLUMN media TEXT')
+        columns = [r[1] for r in self.conn.execute('PRAGMA table_info(quizzes)')]
+        if 'ready' not in columns:
+            self.conn.execute('ALTER TABLE quizzes ADD COLUMN ready INTEGER NOT NULL DEFAULT 1')
+
+    def connect(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+
+    def close(self):
+        # Соединение SQLite нельзя переносить через fork: мастер закрывает своё, воркер открывает новое
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def _insert_questions(self, quiz_id, title, questions, start=0):
+        self.conn.executemany(
+            'INSERT INTO questions (quiz_id, position, text, options, correct_answer, time_limit, media) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(quiz_id, start + i, q['text'], json.dumps(q['options'], ensure_ascii=False),
+              q['correct_answer'], q['time_limit'], q.get('media')) for i, q in enumerate(questions)])
+        self.conn.executemany(
+            'INSERT INTO questions_fts (quiz_id, title, text, options) VALUES (?, ?, ?, ?)',
+            [(quiz_id, title, q['text'], ' '.join(q['options'])) for q in questions])
+
+    def add_quiz(self, title, questions):
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                'INSERT INTO quizzes (title, question_count, created_at) VALUES (?, ?, ?)',
+                (title, len(questions), datetime.now().isoformat()))
+            quiz_id = cur.lastrowid
+            self._insert_questions(quiz_id, title, questions)
+        return quiz_id
+
+    def create_quiz(self, title):
+        # Викторина импортируется пачками и до finish_quiz не видна ни в списке, ни в get_quiz:
+        # иначе игра или кэш любого воркера могли бы взять её недогруженной
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                'INSERT INTO quizzes (title, question_count, created_at, ready) VALUES (?, 0, ?, 0)',
+                (title, datetime.now().isoformat()))
+        return cur.lastrowid
+
+    def append_questions(self, quiz_id, title, questions, start):
+        # Каждая пачка — отдельная транзакция, чтобы импорт не держал всё в памяти
+        with self.lock, self.conn:
+            self._insert_questions(quiz_id, title, questions, start)
+            self.conn.execute('UPDATE quizzes SET question_count = ? WHERE id = ?',
+                              (start + len(questions), quiz_id))
+
+    def finish_quiz(self, quiz_id):
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE quizzes SET ready = 1 WHERE id = ?', (quiz_id,))
+            self.cache.pop(quiz_id, None)
+
+    def delete_quiz(self, quiz_id):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM questions_fts WHERE quiz_id = ?', (quiz_id,))
+            self.conn.execute('DELETE FROM questions WHERE quiz_id = ?', (quiz_id,))
+            self.conn.execute('DELETE FROM quizzes WHERE id = ?', (quiz_id,))
+            self.cache.pop(quiz_id, None)
+
+    def list_quizzes(self, page=1, per_page=20, query=None):
+        page = max(page, 1)
+        per_page = max(1, min(per_page, 100))
+        offset = (page - 1) * per_page
+        with self.lock:
+            match = fts_query(query) if query else ''
+            if match:
+                total = self.conn.execute(
+                    'SELECT COUNT(*) FROM (SELECT DISTINCT quiz_id FROM questions_fts '
+                    'WHERE questions_fts MATCH ?) AS m JOIN quizzes AS q ON q.id = m.quiz_id WHERE q.ready',
+                    (match,)).fetchone()[0]
+                rows = self.conn.execute(
+                    'SELECT q.id, q.title, q.question_count, q.created_at FROM '
+                    '(SELECT quiz_id, MIN(rank) AS score FROM questions_fts WHERE questions_fts MATCH ? '
+                    'GROUP BY quiz_id) AS m JOIN quizzes AS q ON q.id = m.quiz_id WHERE q.ready '
+                    'ORDER BY m.score, q.id DESC LIMIT ? OFFSET ?',
+                    (match, per_page, offset)).fetchall()
+            else:
+                total = self.conn.execute('SELECT COUNT(*) FROM quizzes WHERE ready').fetchone()[0]
+                rows = self.conn.execute(
+                    'SELECT id, title, question_count, created_at FROM quizzes WHERE ready '
+                    'ORDER BY id DESC LIMIT ? OFFSET ?', (per_page, offset)).fetchall()
+        return {
+            'items': [dict(r) for r in rows],
+            'total': total,
+            'page': page,
+            'per_page': per_page
+        }
+
+    @staticmethod
+    def _question_record(row):
+        record = {
+            'text': row['text'],
+            'options': tuple(json.loads(row['options'])),
+            'correct_answer': row['correct_answer'],
+            'time_limit': row['time_limit']
+        }
+        if row['media']:
+            record['media'] = row['media']
+        return record
+
+    def get_quiz(self, quiz_id):
+        with self.lock:
+            quiz = self.cache.get(quiz_id)
+            if quiz is not None:
+                self.cache.move_to_end(quiz_id)
+                return quiz
+            row = self.conn.execute('SELECT id, title FROM quizzes WHERE id = ? AND ready', (quiz_id,)).fetchone()
+            if row is None:
+                return None
+            questions = tuple(self._question_record(r) for r in self.conn.execute(
+                'SELECT text, options, correct_answer, time_limit, media FROM questions '
+                'WHERE quiz_id = ? ORDER BY position', (quiz_id,)))
+            # Записи в кэше уже проверены и нормализованы — create_game их не перерабатывает
+            quiz = {'id': row['id'], 'title': row['title'], 'questions': questions}
+            self.cache[quiz_id] = quiz
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return quiz
+
+    def warm(self, limit):
+        # Заполняем кэш последними викторинами заранее, чтобы воркеры получили его от мастера
+        with self.lock:
+            ids = [r[0] for r in self.conn.execute(
+                'SELECT id FROM quizzes WHERE ready ORDER BY id DESC LIMIT ?', (min(limit, self.cache_size),))]
+        for quiz_id in reversed(ids):
+            self.get_quiz(quiz_id)
+        return len(ids)
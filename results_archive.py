@@ -0,0 +1,114 @@
+import csv
+import io
+import json
+import sqlite3
+from datetime import datetime
+from threading import Lock
+
+EXPORT_COLUMNS = ('question_number', 'question', 'team', 'answer', 'answer_text', 'correct',
+                  'points', 'total_score', 'response_time')
+
+
+class ResultsArchive:
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.conn = None
+        self.connect()
+        self.conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS game_runs (
+                id TEXT PRIMARY KEY,
+                game_code TEXT NOT NULL,
+                title TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                finished_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS game_runs_code ON game_runs(game_code, started_at);
+            CREATE TABLE IF NOT EXISTS answer_log (
+                run_id TEXT NOT NULL,
+                question_number INTEGER NOT NULL,
+                question TEXT NOT NULL,
+                team TEXT NOT NULL,
+                answer INTEGER NOT NULL,
+                answer_text TEXT NOT NULL,
+                correct INTEGER NOT NULL,
+                points INTEGER NOT NULL,
+                total_score INTEGER NOT NULL,
+                response_time REAL
+            );
+            CREATE INDEX IF NOT EXISTS answer_log_run ON answer_log(run_id, question_number);
+        ''')
+
+    def connect(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def start_run(self, run_id, game_code, title):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR IGNORE INTO game_runs (id, game_code, title, started_at) VALUES (?, ?, ?, ?)',
+                (run_id, game_code, title, datetime.now().isoformat()))
+
+    def record_question(self, run_id, question_number, question_text, answers, response_times):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT INTO answer_log (run_id, question_number, question, team, answer, answer_text, '
+                'correct, points, total_score, response_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run_id, question_number, question_text, a['team'], a['answer'], a['answer_text'],
+                  int(a['correct']), a['points_earned'], a['total_score'], rt)
+                 for a, rt in zip(answers, response_times)])
+
+    def finish_run(self, run_id):
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE game_runs SET finished_at = ? WHERE id = ?',
+                              (datetime.now().isoformat(), run_id))
+
+    def find_run(self, game_code, run_id=None):
+        with self.lock:
+            if run_id:
+                row = self.conn.execute('SELECT id FROM game_runs WHERE id = ? AND game_code = ?',
+                                        (run_id, game_code)).fetchone()
+            else:
+                row = self.conn.execute(
+                    'SELECT id FROM game_runs WHERE game_code = ? ORDER BY started_at DESC LIMIT 1',
+                    (game_code,)).fetchone()
+        return row[0] if row else None
+
+    def iter_export(self, run_id, fmt='csv', chunk_rows=500, pause=None):
+        # Отдельное соединение на выгрузку: общий lock не держится между чанками
+        conn = sqlite3.connect(self.path)
+        try:
+            cur = conn.execute(
+                'SELECT %s FROM answer_log WHERE run_id = ? ORDER BY question_number, rowid'
+                % ', '.join(EXPORT_COLUMNS), (run_id,))
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            if fmt == 'csv':
+                writer.writerow(EXPORT_COLUMNS)
+            while True:
+                rows = cur.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                if fmt == 'csv':
+                    writer.writerows(rows)
+                else:
+                    for row in rows:
+                        record = dict(zip(EXPORT_COLUMNS, row))
+                        record['correct'] = bool(record['correct'])
+                        buf.write(json.dumps(record, ensure_ascii=False))
+                        buf.write('\n')
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+                if pause is not None:
+                    pause()
+            if buf.tell():
+                yield buf.getvalue()
+        finally:
+            conn.close()
@@ -0,0 +1,102 @@
+import os
+import sys
+from collections import Counter
+
+import greenlet
+
+try:
+    # Под gunicorn/gevent модули threading и time пропатчены — сэмплеру нужен настоящий поток ОС
+    from gevent.monkey import get_original
+    _start_thread = get_original('_thread', 'start_new_thread')
+    _get_ident = get_original('_thread', 'get_ident')
+    _sleep = get_original('time', 'sleep')
+    _monotonic = get_original('time', 'monotonic')
+except ImportError:
+    from _thread import start_new_thread as _start_thread, get_ident as _get_ident
+    from time import sleep as _sleep, monotonic as _monotonic
+
+try:
+    from gevent.hub import Hub
+except ImportError:
+    Hub = None
+
+
+def greenlet_label(g):
+    if g is None or g.parent is None:
+        return 'main'
+    if Hub is not None and isinstance(g, Hub):
+        return 'hub'
+    run = getattr(g, '_run', None) or getattr(g, 'run', None)
+    name = getattr(run, '__qualname__', None) or getattr(run, '__name__', None)
+    return 'greenlet:%s' % (name or type(g).__name__)
+
+
+def frame_label(code):
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, filter_codes=None):
+        self.interval = interval
+        self.filter_codes = filter_codes
+        self.samples = Counter()
+        self.total = 0
+        self._current = None
+        self._running = False
+        self._done = True
+        self._target_ident = None
+        self._prev_trace = None
+
+    def _trace(self, event, args):
+        if event in ('switch', 'throw'):
+            self._current = args[1]
+        if self._prev_trace is not None:
+            self._prev_trace(event, args)
+
+    def start(self):
+        # Запускается из потока, в котором крутится цикл событий
+        self._target_ident = _get_ident()
+        self._current = greenlet.getcurrent()
+        self._prev_trace = greenlet.settrace(self._trace)
+        self._running = True
+        self._done = False
+        _start_thread(self._sample_loop, ())
+
+    def stop(self):
+        self._running = False
+        greenlet.settrace(self._prev_trace)
+        while not self._done:
+            _sleep(self.interval)
+
+    def _sample_loop(self):
+        try:
+            while self._running:
+                next_tick = _monotonic() + self.interval
+                frame = sys._current_frames().get(self._target_ident)
+                if frame is not None:
+                    self._record(frame, self._current)
+                delay = next_tick - _monotonic()
+                if delay > 0:
+                    _sleep(delay)
+        finally:
+            self._done = True
+
+    def _record(self, frame, current):
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        if self.filter_codes is not None:
+            start = next((i for i, c in enumerate(codes) if c in self.filter_codes), None)
+            if start is None:
+                return
+            codes = codes[start:]
+        stack = (greenlet_label(current),) + tuple(frame_label(c) for c in codes)
+        self.samples[stack] += 1
+        self.total += 1
+
+    def collapsed(self):
+        # Формат collapsed stacks для flamegraph.pl / speedscope
+        lines = ['%s %d' % (';'.join(stack), count) for stack, count in self.samples.most_common()]
+        return '\n'.join(lines) + '\n'
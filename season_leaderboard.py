@@ -0,0 +1,215 @@
+import random
+import sqlite3
+from datetime import datetime
+from threading import Lock
+
+MAX_LEVELS = 32
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class RankedSkipList:
+    # Skip list с ширинами ссылок: вставка, удаление, ранг и доступ по индексу за O(log N)
+    def __init__(self):
+        self.head = _Node(None, MAX_LEVELS)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _random_level():
+        level = 1
+        while level < MAX_LEVELS and random.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key):
+        chain = [None] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+        node = self.head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        new_node = _Node(key, self._random_level())
+        steps = 0
+        for level in range(len(new_node.next)):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(len(new_node.next), MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain = [None] * MAX_LEVELS
+        node = self.head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key):
+        node = self.head
+        position = 0
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        return position
+
+    def _node_at(self, index):
+        node = self.head
+        index += 1
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.width[level] <= index:
+                index -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def slice(self, start, count):
+        start = max(start, 0)
+        if start >= self.size or count <= 0:
+            return []
+        node = self._node_at(start)
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class SeasonLeaderboard:
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.indexes = {}
+        self.conn = None
+        self.connect()
+        self.conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS season_scores (
+                season TEXT NOT NULL,
+                team TEXT NOT NULL,
+                score INTEGER NOT NULL,
+                games INTEGER NOT NULL,
+                updated_at TEXT NOT NULL,
+                seq INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (season, team)
+            );
+            CREATE TABLE IF NOT EXISTS season_versions (
+                season TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+        ''')
+        columns = [r[1] for r in self.conn.execute('PRAGMA table_info(season_scores)')]
+        if 'seq' not in columns:
+            self.conn.execute('ALTER TABLE season_scores ADD COLUMN seq INTEGER NOT NULL DEFAULT 0')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS season_scores_seq ON season_scores(season, seq)')
+
+    def connect(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def _version(self, season):
+        row = self.conn.execute('SELECT version FROM season_versions WHERE season = ?', (season,)).fetchone()
+        return row[0] if row else 0
+
+    def _index(self, season):
+        # Индекс сезона строится один раз из SQLite. Игры пишут и другие воркеры, поэтому перед
+        # каждым ответом сверяем версию сезона и досчитываем строки, изменённые после неё
+        version = self._version(season)
+        index = self.indexes.get(season)
+        if index is None:
+            ranking = RankedSkipList()
+            teams = {}
+            for team, score, games in self.conn.execute(
+                    'SELECT team, score, games FROM season_scores WHERE season = ?', (season,)):
+                teams[team] = (score, games)
+                ranking.insert((-score, team))
+            index = self.indexes[season] = [ranking, teams, version]
+        elif index[2] < version:
+            ranking, teams = index[0], index[1]
+            # Значения в строках абсолютные: строку, попавшую и сюда, и в следующую сверку, применяем дважды без вреда
+            for team, score, games in self.conn.execute(
+                    'SELECT team, score, games FROM season_scores WHERE season = ? AND seq > ?',
+                    (season, index[2])):
+                old = teams.get(team)
+                if old is not None:
+                    ranking.remove((-old[0], team))
+                teams[team] = (score, games)
+                ranking.insert((-score, team))
+            index[2] = version
+        return index[0], index[1]
+
+    def record_game(self, season, final_results):
+        now = datetime.now().isoformat()
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    'INSERT INTO season_versions (season, version) VALUES (?, 1) '
+                    'ON CONFLICT (season) DO UPDATE SET version = version + 1', (season,))
+                version = self._version(season)
+                self.conn.executemany(
+                    'INSERT INTO season_scores (season, team, score, games, updated_at, seq) '
+                    'VALUES (?, ?, ?, 1, ?, ?) '
+                    'ON CONFLICT (season, team) DO UPDATE SET score = score + excluded.score, '
+                    'games = games + 1, updated_at = excluded.updated_at, seq = excluded.seq',
+                    [(season, r['name'], r['score'], now, version) for r in final_results])
+            self._index(season)
+
+    def _entries(self, teams, keys, first_rank):
+        return [{'rank': first_rank + i + 1, 'team': team, 'score': -neg_score, 'games': teams[team][1]}
+                for i, (neg_score, team) in enumerate(keys)]
+
+    def top(self, season, limit=10):
+        with self.lock:
+            ranking, teams = self._index(season)
+            return {'total': len(ranking), 'leaders': self._entries(teams, ranking.slice(0, limit), 0)}
+
+    def team(self, season, team, around=0):
+        with self.lock:
+            ranking, teams = self._index(season)
+            if team not in teams:
+                return None
+            score, games = teams[team]
+            rank = ranking.rank((-score, team))
+            start = max(rank - around, 0)
+            return {
+                'rank': rank + 1,
+                'team': team,
+                'score': score,
+                'games': games,
+                'total': len(ranking),
+                'neighbors': self._entries(teams, ranking.slice(start, rank - start + around + 1), start)
+            }
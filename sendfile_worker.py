@@ -0,0 +1,39 @@
+import os
+
+from gevent.socket import wait_write
+from gevent.ssl import SSLSocket
+from geventwebsocket.gunicorn.workers import GeventWebSocketWorker
+from geventwebsocket.handler import WebSocketHandler
+
+from media_store import MediaFile
+
+# Воркер gunicorn для продакшена: gevent pywsgi не умеет sendfile и отдаёт файлы
+# кусками через память процесса. Здесь тело MediaFile уходит в сокет через os.sendfile
+# прямо из page cache, без копирования в Python. С TLS ядро шифровать не умеет —
+# тогда отдаём обычной итерацией.
+
+
+class SendfileHandler(WebSocketHandler):
+    def process_result(self):
+        media = self.result
+        if not isinstance(media, MediaFile) or isinstance(self.socket, SSLSocket):
+            return super().process_result()
+        # Заголовки уходят с пустым телом; Content-Length задан, поэтому без chunked
+        self.write(b'')
+        sock = self.socket.fileno()
+        offset, remaining = media.offset, media.length
+        while remaining > 0:
+            try:
+                sent = os.sendfile(sock, media.fileno(), offset, remaining)
+            except BlockingIOError:
+                wait_write(sock, timeout=self.socket.timeout)
+                continue
+            if sent == 0:
+                break
+            offset += sent
+            remaining -= sent
+            self.response_length += sent
+
+
+class SendfileWebSocketWorker(GeventWebSocketWorker):
+    wsgi_handler = SendfileHandler
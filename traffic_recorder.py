@@ -0,0 +1,131 @@
+import gzip
+import inspect
+import json
+import os
+import time
+from datetime import datetime
+from functools import wraps
+from threading import Lock
+
+# Запись входящего трафика для воспроизведения (benchmarks/replay.py).
+# Файл — gzip с JSON-строками, первая строка — заголовок, дальше записи:
+#   [мс, 's', соединение, событие, данные]   — событие сокета (connect/disconnect тоже)
+#   [мс, 'h', метод, путь?запрос, тело]      — вызов /api/*; вместо не-JSON, потокового (импорт, медиа)
+#                                              или большого тела {'_bytes': размер}
+#   [мс, 'g', код игры]                      — код, выданный последним create_game
+# Соединения нумеруются по порядку, названия команд заменяются на team-N.
+# Админские вызовы не пишутся: в них токен.
+
+RECORD_VERSION = 1
+ANONYMIZED_KEYS = ('team_name', 'player_name', 'team')
+TEAM_PATH = '/api/season/team/'
+FLUSH_INTERVAL = 1.0
+# Загрузки читаются обработчиком потоком: если прочитать тело заранее, обработчику ничего не достанется
+STREAMED_PATHS = ('/api/quizzes/import', '/api/media')
+MAX_BODY = 64 * 1024
+
+
+class TrafficRecorder:
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.file = None
+        self.started = None
+        self.flushed_at = 0
+        self.connections = {}
+        self.next_connection = 0
+        self.names = {}
+
+    def open(self):
+        # Файл открывается при первой записи, уже в воркере; {pid} в пути — свой файл на воркер
+        self.file = gzip.open(self.path.format(pid=os.getpid()), 'wt', encoding='utf-8', compresslevel=6)
+        self.started = time.monotonic()
+        self.file.write(json.dumps({'v': RECORD_VERSION, 'started': datetime.now().isoformat()}) + '\n')
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def write(self, record):
+        with self.lock:
+            if self.file is None:
+                self.open()
+            now = time.monotonic()
+            record[0] = int((now - self.started) * 1000)
+            self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            # Сбрасываем раз в секунду: запись читается, даже если процесс убили
+            if now - self.flushed_at >= FLUSH_INTERVAL:
+                self.flushed_at = now
+                self.file.flush()
+
+    def team(self, name):
+        alias = self.names.get(name)
+        if alias is None:
+            alias = self.names[name] = 'team-%d' % len(self.names)
+        return alias
+
+    def anonymize(self, value):
+        if isinstance(value, dict):
+            return {k: self.team(v) if k in ANONYMIZED_KEYS and isinstance(v, str) else self.anonymize(v)
+                    for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.anonymize(v) for v in value]
+        return value
+
+    def socket_event(self, sid, event, args):
+        connection = self.connections.get(sid)
+        if connection is None:
+            connection = self.connections[sid] = self.next_connection
+            self.next_connection += 1
+        data = args[0] if args and event not in ('connect', 'disconnect') else None
+        self.write([0, 's', connection, event, self.anonymize(data)])
+        if event == 'disconnect':
+            self.connections.pop(sid, None)
+
+    def http_call(self, method, path, query, body, size):
+        # body — JSON-тело запроса; потоковые загрузки (медиа, импорт) не читаем, пишем только размер
+        if path.startswith(TEAM_PATH):
+            path = TEAM_PATH + self.team(path[len(TEAM_PATH):])
+        if query:
+            path += '?' + query
+        data = None
+        if body:
+            try:
+                data = self.anonymize(json.loads(body))
+            except ValueError:
+                data = {'_bytes': len(body)}
+        elif size:
+            data = {'_bytes': size}
+        self.write([0, 'h', method, path, data])
+
+    def game_created(self, game_code):
+        self.write([0, 'g', game_code])
+
+    def wrap(self, event, handler):
+        if inspect.iscoroutinefunction(handler):
+            async def recorded(sid, *args):
+                self.socket_event(sid, event, args)
+                return await handler(sid, *args)
+        else:
+            def recorded(sid, *args):
+                self.socket_event(sid, event, args)
+                return handler(sid, *args)
+        return wraps(handler)(recorded)
+
+    def install(self, server):
+        # Оборачиваем обработчики python-socketio (Server или AsyncServer) после регистрации всех событий
+        handlers = server.handlers.setdefault('/', {})
+        handlers.setdefault('connect', lambda sid, environ, auth=None: None)
+        for event, handler in list(handlers.items()):
+            handlers[event] = self.wrap(event, handler)
+
+
+def should_record(path):
+    return path.startswith('/api/') and not path.startswith('/api/admin/')
+
+
+def should_capture_body(path, size):
+    # size — Content-Length; без него (chunked) тело не читаем
+    return path not in STREAMED_PATHS and size is not None and size <= MAX_BODY